@@ -1,13 +1,8 @@
 import streamlit as st
 import os
-import tempfile
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import pandas as pd
-from src.asr_whisper import transcribe_audio
-from src.emotion_model import detect_emotion
+# plotly, pandas and the model stack (torch, whisper, transformers) are
+# imported inside the pages that use them, so Home/About render without them
 
 st.set_page_config(
     page_title="Emotion-Aware ASR",
@@ -115,11 +110,52 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Whisper model for uploads; "auto" starts with a small model and escalates
+# low-confidence segments (see kuiskaus.model_tiers)
+MODEL_SIZES = ["auto", "tiny", "base", "small", "medium"]
+MODEL_SIZE = os.environ.get("ASR_MODEL_SIZE", "small")
+
 if 'current_page' not in st.session_state:
     st.session_state.current_page = "Home"
 
+@st.cache_resource
+def get_model_cache():
+    # One registry per server process, shared by every session; models load
+    # lazily, with an optional background warm-up when the server starts
+    from mallit import MODEL_CACHE
+    if os.environ.get("ASR_WARM_UP", "1") != "0":
+        import threading
+
+        def _warm_up():
+            # Key lookup imports torch, so it happens off the script thread too
+            from tunne import audio_cache_key, text_cache_key
+            from kuiskaus import DEFAULT_ENGINE, preload
+            from analyysi import default_thread_budgets
+            # Same engine and ASR thread budget as the parallel analyze() calls
+            # below, so the warmed model is the one they look up
+            try:
+                preload(MODEL_SIZE, engine=DEFAULT_ENGINE, cpu_threads=default_thread_budgets()[0])
+            except Exception as e:
+                print(f"[WARN] Warm-up failed for the {DEFAULT_ENGINE} ASR model: {e}")
+            MODEL_CACHE.warm_up([audio_cache_key(), text_cache_key()], background=False)
+
+        threading.Thread(target=_warm_up, name="model-warm-up", daemon=True).start()
+    return MODEL_CACHE
+
+@st.cache_resource
+def get_result_cache():
+    from välimuisti import ResultCache
+    return ResultCache()
+
+@st.cache_resource
+def get_result_store():
+    from tulokset import DEFAULT_STORE_DIR, ResultStore
+    return ResultStore(os.environ.get("ASR_RESULTS_STORE", DEFAULT_STORE_DIR))
+
 def main():
-    col1, col2, col3 = st.columns(3)
+    if not os.environ.get("ASR_SERVER_URL"):
+        get_model_cache()
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         if st.button("Home", use_container_width=True):
@@ -132,6 +168,11 @@ def main():
             st.rerun()
     
     with col3:
+        if st.button("Dashboard", use_container_width=True):
+            st.session_state.current_page = "Dashboard"
+            st.rerun()
+
+    with col4:
         if st.button("About", use_container_width=True):
             st.session_state.current_page = "About"
             st.rerun()
@@ -142,6 +183,8 @@ def main():
         show_about()
     elif st.session_state.current_page == "Get Started":
         show_start_using()
+    elif st.session_state.current_page == "Dashboard":
+        show_dashboard()
 
 def show_home():
     st.title("Welcome to Emotion-Aware ASR")
@@ -219,6 +262,26 @@ def show_about():
         4. Confidence scoring and result fusion
         5. Interactive visualization generation
         """)
+
+        with st.expander("Loaded models"):
+            cache = get_model_cache()
+            counters = cache.counters()
+            st.caption(f"Cache hits: {counters['hits']} | misses: {counters['misses']} | "
+                       f"evictions: {counters['evictions']} | resident: {counters['resident_mb']:.0f} MB")
+            stats = cache.stats()
+            if stats:
+                import pandas as pd
+                st.dataframe(pd.DataFrame([
+                    {"Model": key, "Load time (s)": round(s["load_s"], 2),
+                     "Weights (MB)": round(s["memory_mb"], 1), "RSS increase (MB)": round(s["rss_delta_mb"], 1)}
+                    for key, s in stats.items()]), use_container_width=True)
+            else:
+                st.write("No models loaded yet.")
+            from kuiskaus import tier_stats
+            tiers = tier_stats()
+            if tiers["files"]:
+                st.caption(f"Tiered transcription: {tiers['escalated_files']} of {tiers['files']} files escalated, "
+                           f"{tiers['escalation_rate']:.0%} of the audio")
     
     with tab3:
         st.markdown("""
@@ -245,6 +308,81 @@ def show_about():
         - **User Experience**: Test emotional responses to interfaces
         """)
 
+def show_dashboard():
+    # Aggregates come straight from the memory-mapped store; only the grouped
+    # results are turned into DataFrames
+    import pandas as pd
+    import plotly.express as px
+
+    st.title("Emotion Dashboard")
+    store = get_result_store()
+    if not len(store):
+        st.info(f"No stored results yet in {store.directory}. Run pipeline.py with --store, "
+                "a batch with --output <dir>.store, or set ASR_RESULTS_STORE for this app.")
+        return
+
+    time_fields = {"Recording": "recorded_at", "Analysis": "analyzed_at"}
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        source = st.radio("Emotion source", ["audio", "text"], horizontal=True)
+    with col2:
+        time_field = time_fields[st.radio("Day of", list(time_fields), horizontal=True,
+                                          help="Uploads in this app have no recording time")]
+    timestamps = np.asarray(store.column(time_field))
+    timestamps = timestamps[~np.isnan(timestamps)]
+    if not len(timestamps):
+        st.warning("No stored results have this kind of timestamp.")
+        return
+    first = np.datetime64(int(timestamps.min()), "s").astype("datetime64[D]").item()
+    last = np.datetime64(int(timestamps.max()), "s").astype("datetime64[D]").item()
+    with col3:
+        date_range = st.date_input("Days (UTC)", (first, last), min_value=first, max_value=last)
+    with col4:
+        languages = sorted(lang for lang in store.categories("lang") if lang)
+        language = st.selectbox("Language", ["All"] + languages)
+
+    since = until = None
+    if isinstance(date_range, (tuple, list)) and len(date_range) == 2:
+        since = np.datetime64(date_range[0], "s").astype(np.int64)
+        until = (np.datetime64(date_range[1], "s") + np.timedelta64(1, "D")).astype(np.int64)
+    language = None if language == "All" else language
+
+    per_day = store.emotion_distribution("day", source, since=since, until=until, language=language,
+                                         time_field=time_field)
+    per_lang = store.emotion_distribution("lang", source, since=since, until=until, language=language,
+                                          time_field=time_field)
+    if not len(per_day["count"]):
+        st.warning("No results match the filters.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Calls", int(per_day["count"].sum()))
+    with col2:
+        st.metric("Days", len(per_day["keys"]))
+
+    day_df = pd.DataFrame(per_day["mean"], columns=per_day["labels"])
+    day_df["Day"] = [str(day) for day in per_day["keys"]]
+    fig_day = px.bar(
+        day_df.melt(id_vars="Day", var_name="Emotion", value_name="Mean confidence"),
+        x="Day",
+        y="Mean confidence",
+        color="Emotion",
+        title=f"{source.title()} Emotion Distribution per Day")
+    fig_day.update_layout(height=400)
+    st.plotly_chart(fig_day, use_container_width=True)
+
+    lang_df = pd.DataFrame(per_lang["top"], columns=per_lang["labels"])
+    lang_df["Language"] = per_lang["keys"]
+    fig_lang = px.bar(
+        lang_df.melt(id_vars="Language", var_name="Emotion", value_name="Calls"),
+        x="Language",
+        y="Calls",
+        color="Emotion",
+        title=f"Top {source.title()} Emotion per Language")
+    fig_lang.update_layout(height=400)
+    st.plotly_chart(fig_lang, use_container_width=True)
+
 def show_start_using():
     st.title("Start Using Emotion-Aware ASR")    
     st.markdown("### Upload Audio File")
@@ -254,44 +392,128 @@ def show_start_using():
         help="Supported formats: WAV, MP3. The model automatically detects the language.")
     
     if uploaded_file is not None:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            temp_path = tmp_file.name        
+        upload = get_upload(uploaded_file)
         st.success(f"File uploaded successfully")
         
-        st.audio(uploaded_file.getvalue())
+        st.audio(uploaded_file)
+
+        model_size = st.selectbox(
+            "Whisper model",
+            MODEL_SIZES,
+            index=MODEL_SIZES.index(MODEL_SIZE) if MODEL_SIZE in MODEL_SIZES else 0,
+            help="'auto' transcribes with a fast model first and re-checks only unclear passages with a larger one.")
         
         if st.button("Analyze Audio", type="primary"):
-            analyze_audio(temp_path)
-        
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+            analyze_audio(upload, model_size)
+
+def get_upload(uploaded_file):
+    # Decode each upload once per session, straight from the uploaded bytes
+    # (no temp file), and reuse it on every rerun and "Analyze Audio" click.
+    # Only the current upload is kept so session memory stays bounded.
+    from ääni import load_audio
+    from välimuisti import hash_audio
+
+    upload_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    upload = st.session_state.get("upload")
+    if upload is None or upload["id"] != upload_id:
+        data = uploaded_file.getbuffer()
+        upload = {
+            "id": upload_id,
+            "name": uploaded_file.name,
+            "file": uploaded_file,
+            "hash": hash_audio(data),
+            "waveform": load_audio(data),
+        }
+        st.session_state.upload = upload
+    return upload
+
+# Share of the progress bar each traced stage accounts for when it finishes
+STAGE_PROGRESS = {
+    "cache_lookup": 5, "decode": 10, "model_load": 15, "whisper": 35,
+    "langdetect": 5, "audio_emotion": 20, "text_emotion": 10,
+}
+STAGE_NAMES = {
+    "cache_lookup": "Checked result cache", "decode": "Decoded audio", "model_load": "Models ready",
+    "whisper": "Transcribed audio", "langdetect": "Identified language",
+    "audio_emotion": "Analyzed voice emotion", "text_emotion": "Analyzed text emotion",
+}
+
+def _analyze_with_progress(upload, model_size, progress_bar, status_text):
+    # analyze runs in a worker thread; finished stages arrive through the
+    # tracer callback and the script thread turns them into real progress
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+    from jäljitys import Tracer
+    from analyysi import analyze
+
+    finished = queue.Queue()
+    tracer = Tracer(on_stage=lambda span: finished.put(span["stage"]))
+    status_text.text("Transcribing audio and analyzing emotions...")
+    done = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(
+            analyze, upload["waveform"], audio_hash=upload["hash"], model_size=model_size, force_language=None, parallel=True,
+            cache=get_result_cache(), window_s=10.0, hop_s=5.0, segments=True, tracer=tracer)
+        while True:
+            try:
+                stage = finished.get(timeout=0.1)
+            except queue.Empty:
+                if future.done():
+                    break
+                continue
+            done = min(99, done + STAGE_PROGRESS.get(stage, 0))
+            progress_bar.progress(done)
+            status_text.text(f"{STAGE_NAMES.get(stage, stage)}...")
+        return future.result()
 
-def analyze_audio(audio_path):
+def analyze_audio(upload, model_size=MODEL_SIZE):
     with st.spinner("Processing audio... This may take a moment."):
         try:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Step 1: Transcription
-            status_text.text("Transcribing audio...")
-            progress_bar.progress(25)
-            transcript, detected_lang, whisper_lang = transcribe_audio(audio_path, model_size="small",force_language=None)
-            
-            # Step 2: Emotion Detection
-            status_text.text("Analyzing emotions...")
-            progress_bar.progress(75)
-            
-            (final_audio_label, audio_score, audio_predictions, 
-             final_text_label, text_score, text_predictions) = detect_emotion(
-                audio_path, transcript, debug=False)
+            server_url = os.environ.get("ASR_SERVER_URL")
+            if server_url:
+                # Remote backend: models stay resident in the pipeline.py --mode serve process
+                status_text.text("Sending audio to the analysis server...")
+                progress_bar.progress(10)
+                from palvelin import analyze_remote
+                result = analyze_remote(server_url, upload["file"].getbuffer(), model_size=model_size)
+            else:
+                result = _analyze_with_progress(upload, model_size, progress_bar, status_text)
+            transcript, detected_lang, whisper_lang = result["transcript"], result["detected_lang"], result["whisper_lang"]
+            final_audio_label, audio_score, audio_predictions = result["audio_label"], result["audio_score"], result["audio_predictions"]
+            final_text_label, text_score, text_predictions = result["text_label"], result["text_score"], result["text_predictions"]
             
+            if "fused_predictions" not in result:
+                from fuusio import add_fusion
+                add_fusion(result)
+
+            if os.environ.get("ASR_RESULTS_STORE"):
+                get_result_store().append({"path": upload["name"], **result})
+
             progress_bar.progress(100)
             display_results(
                 transcript, detected_lang, whisper_lang,
                 final_audio_label, audio_score, audio_predictions,
-                final_text_label, text_score, text_predictions
+                final_text_label, text_score, text_predictions,
+                audio_timeline=result.get("audio_timeline"),
+                text_segments=result.get("text_segments"),
+                fused_predictions=result["fused_predictions"]
             )
+
+            if result.get("asr_tiers"):
+                tiers = result["asr_tiers"]
+                st.caption(f"Transcribed with {' → '.join(tiers['models'])}; "
+                           f"{tiers['escalation_rate']:.0%} of the audio was re-checked with the larger model.")
+
+            if result.get("trace"):
+                import pandas as pd
+                with st.expander("Stage timings"):
+                    st.dataframe(pd.DataFrame([
+                        {"Stage": span["stage"], "Wall (s)": round(span["wall_s"], 3),
+                         "CPU (s)": round(span["cpu_s"], 3), "Peak RSS (MB)": round(span["rss_peak_mb"])}
+                        for span in result["trace"]]), use_container_width=True)
             
         except Exception as e:
             st.error(f"Error during analysis: {str(e)}")
@@ -299,7 +521,10 @@ def analyze_audio(audio_path):
 
 def display_results(transcript, detected_lang, whisper_lang, 
                    final_audio_label, audio_score, audio_predictions,
-                   final_text_label, text_score, text_predictions):
+                   final_text_label, text_score, text_predictions,
+                   audio_timeline=None, text_segments=None, fused_predictions=None):
+    import pandas as pd
+    import plotly.express as px
     
     # Transcript section
     st.markdown("### Annotated Transcript")
@@ -362,21 +587,68 @@ def display_results(transcript, detected_lang, whisper_lang,
             st.plotly_chart(fig_text, use_container_width=True)
     
     st.markdown("### Emotion Comparison")
-    comparison_data = {
-        'Analysis Type': ['Audio-based', 'Text-based'],
-        'Primary Emotion': [final_audio_label.split('(')[0].strip(), final_text_label],
-        'Confidence': [audio_score, text_score]}
-    
-    fig_comparison = px.bar(
-        comparison_data,
-        x='Analysis Type',
-        y='Confidence',
-        color='Primary Emotion',
-        title="Audio vs Text Emotion Analysis Comparison",
-        text='Primary Emotion')
-    fig_comparison.update_traces(textposition='inside')
-    fig_comparison.update_layout(height=400)
+    if fused_predictions:
+        # Voice and text scores projected onto the same seven labels, next to the fused result
+        from fuusio import AUDIO_TO_FUSED, FUSED_LABELS
+        from tunne import AUDIO_LABELS, TEXT_LABELS, score_vector
+        audio_vec = score_vector(audio_predictions, AUDIO_LABELS)
+        audio_vec = audio_vec / max(float(audio_vec.sum()), 1e-9) @ AUDIO_TO_FUSED
+        sources = {
+            'Audio-based': audio_vec,
+            'Text-based': score_vector(text_predictions, TEXT_LABELS),
+            'Fused': score_vector(fused_predictions, FUSED_LABELS),
+        }
+        comparison_df = pd.DataFrame([
+            {'Emotion': lbl, 'Analysis Type': name, 'Confidence': float(vec[i])}
+            for name, vec in sources.items() for i, lbl in enumerate(FUSED_LABELS)])
+        fig_comparison = px.bar(
+            comparison_df,
+            x='Emotion',
+            y='Confidence',
+            color='Analysis Type',
+            barmode='group',
+            title=f"Audio vs Text vs Fused Emotion (fused: {fused_predictions[0][0]})")
+        fig_comparison.update_layout(height=400)
+    else:
+        comparison_data = {
+            'Analysis Type': ['Audio-based', 'Text-based'],
+            'Primary Emotion': [final_audio_label.split('(')[0].strip(), final_text_label],
+            'Confidence': [audio_score, text_score]}
+
+        fig_comparison = px.bar(
+            comparison_data,
+            x='Analysis Type',
+            y='Confidence',
+            color='Primary Emotion',
+            title="Audio vs Text Emotion Analysis Comparison",
+            text='Primary Emotion')
+        fig_comparison.update_traces(textposition='inside')
+        fig_comparison.update_layout(height=400)
     st.plotly_chart(fig_comparison, use_container_width=True)
 
+    # Audio emotion over time (only meaningful with more than one window)
+    if audio_timeline and len(audio_timeline) > 1:
+        st.markdown("### Audio Emotion Timeline")
+        timeline_df = pd.DataFrame([
+            {'Time (s)': (entry['start'] + entry['end']) / 2, 'Emotion': lbl, 'Confidence': sc}
+            for entry in audio_timeline for lbl, sc in entry['predictions']])
+        fig_timeline = px.line(
+            timeline_df,
+            x='Time (s)',
+            y='Confidence',
+            color='Emotion',
+            markers=True,
+            title="Audio Emotion per Window")
+        fig_timeline.update_layout(height=350)
+        st.plotly_chart(fig_timeline, use_container_width=True)
+
+    if text_segments and len(text_segments) > 1:
+        with st.expander("Text Emotion per Segment"):
+            segments_df = pd.DataFrame([
+                {'Start (s)': round(seg['start'], 1), 'End (s)': round(seg['end'], 1),
+                 'Text': seg['text'], 'Emotion': seg['label'], 'Confidence': round(seg['score'], 2)}
+                for seg in text_segments])
+            st.dataframe(segments_df, use_container_width=True)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,255 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ääni import load_audio
+from kuiskaus import (DEFAULT_ENGINE, TIER_MAX_NO_SPEECH, TIER_MIN_LOGPROB, encoder_embedding, model_tiers,
+                      preload, transcribe_audio)
+from tunne import (AUDIO_MODEL_NAME, TEXT_MODEL_NAME, detect_audio_emotion, get_audio_classifier,
+                   get_backend, get_text_classifier,
+                   detect_audio_emotion_windowed, detect_text_emotion,
+                   detect_text_emotion_segments, print_debug)
+from välimuisti import hash_audio
+from puhe import detect_speech
+from jäljitys import trace_stage
+from fuusio import DEFAULT_HEAD, add_fusion
+
+_EXECUTOR = None
+
+def _executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="analyysi")
+    return _EXECUTOR
+
+def default_thread_budgets(threads: int = None):
+    # (ASR, emotion) split of a total budget, default all cores. Only the
+    # ctranslate2 engine can hold to it: its ASR pool is separate from torch.
+    # Whisper decoding is the heavier half; give it roughly two thirds
+    cores = threads or os.cpu_count() or 1
+    asr_threads = max(1, (cores * 2) // 3)
+    emo_threads = max(1, cores - asr_threads)
+    return asr_threads, emo_threads
+
+def _set_torch_threads(n_threads):
+    # torch.set_num_threads is process-wide: every torch op, from any thread,
+    # runs with that many intra-op threads. Set once, before the tasks start.
+    import torch
+    if torch.get_num_threads() != n_threads:
+        torch.set_num_threads(n_threads)
+
+def result_dict(asr, audio_emo, text_emo):
+    transcript, detected_lang, whisper_lang = asr
+    final_audio_label, audio_score, audio_predictions = audio_emo
+    final_text_label, text_score, text_predictions = text_emo
+    return {
+        "transcript": transcript,
+        "detected_lang": detected_lang,
+        "whisper_lang": whisper_lang,
+        "audio_label": final_audio_label,
+        "audio_score": audio_score,
+        "audio_predictions": audio_predictions,
+        "text_label": final_text_label,
+        "text_score": text_score,
+        "text_predictions": text_predictions,
+    }
+
+def _from_cache(result):
+    # JSON turns the (label, score) tuples into lists
+    for field in ("audio_predictions", "text_predictions", "fused_predictions"):
+        if field in result:
+            result[field] = [tuple(p) for p in result[field]]
+    for entry in (result.get("audio_timeline") or []) + (result.get("text_segments") or []):
+        entry["predictions"] = [tuple(p) for p in entry["predictions"]]
+    return result
+
+def _audio_task(audio, window_s=None, hop_s=None, tracer=None):
+    # Returns the detect_audio_emotion triple plus the window timeline (or None)
+    with trace_stage(tracer, "audio_emotion"):
+        if window_s:
+            return detect_audio_emotion_windowed(audio, window_s, hop_s or window_s / 2)
+        return (*detect_audio_emotion(audio), None)
+
+def _text_task(transcript, segments=None, tracer=None):
+    # Returns the detect_text_emotion triple plus per-segment results (or None)
+    with trace_stage(tracer, "text_emotion"):
+        if segments is not None:
+            return detect_text_emotion_segments(segments)
+        return (*detect_text_emotion(transcript), None)
+
+def _head_task(head, audio, tracer=None):
+    # Voice emotion from the pooled encoder output of the Whisper model the
+    # head was fitted on, whatever model or engine does the transcription
+    with trace_stage(tracer, "audio_emotion", model="whisper_head"):
+        embedding = encoder_embedding(audio, head.whisper_model)
+        if head.weights.shape[0] != len(embedding):
+            raise RuntimeError(f"Embedding head expects {head.weights.shape[0]}-dim features "
+                               f"but whisper {head.whisper_model} gives {len(embedding)}")
+        return (*head.audio_emotion(embedding), None)
+
+def _remap(entries, speech_map):
+    # Timestamps from the speech-only waveform back onto the original recording
+    for entry in entries or []:
+        entry["start"] = speech_map.to_original(entry["start"])
+        entry["end"] = speech_map.to_original(entry["end"])
+
+def analyze(audio, model_size="small", force_language=None, parallel=True,
+            threads=None, debug=False, cache=None,
+            window_s=None, hop_s=None, segments=False, asr_options=None, vad=None, tracer=None,
+            audio_hash=None, fusion=None, emotion_head=None):
+    # asr_options: engine, beam_size, vad_filter, cpu_threads (see transcribe_audio)
+    # threads: total CPU threads for a parallel analysis (default all cores)
+    # fusion: "late" adds a fused 7-label distribution (fuusio.py); "whisper"
+    # also replaces wav2vec2 with a head over Whisper encoder embeddings
+    # (emotion_head: .npz path, default $EMOTION_HEAD)
+    # vad: "energy" or "silero" to run the models on detected speech only
+    # tracer: jäljitys.Tracer; per-stage figures are returned under "trace"
+    # audio_hash: content hash computed by the caller (e.g. of the encoded upload)
+    asr_options = dict(asr_options or {})
+    engine = asr_options.get("engine") or DEFAULT_ENGINE
+    if engine != "ctranslate2" and asr_options.pop("vad_filter", False):
+        # Dropped before the cache key, so it cannot split identical results
+        print("[ASR] vad_filter is only supported by the ctranslate2 engine; ignoring it")
+    cache_key = None
+    if cache is not None:
+        # Settings that come from the environment are resolved into the key,
+        # so changing $ASR_ENGINE, $ASR_TIERS* or $EMOTION_HEAD cannot return stale results
+        asr_key = {**asr_options, "engine": engine}
+        tiers = model_tiers(model_size)
+        if len(tiers) > 1:
+            asr_key.setdefault("tier_min_logprob", TIER_MIN_LOGPROB)
+            asr_key.setdefault("tier_max_no_speech", TIER_MAX_NO_SPEECH)
+        with trace_stage(tracer, "cache_lookup"):
+            cache_key = cache.key(
+                audio_hash or hash_audio(audio),
+                model_size=model_size,
+                force_language=force_language,
+                audio_model=AUDIO_MODEL_NAME,
+                text_model=TEXT_MODEL_NAME,
+                emotion_backend=get_backend(),
+                window_s=window_s,
+                hop_s=hop_s,
+                segments=segments,
+                asr_options=asr_key,
+                asr_tiers=list(tiers),
+                vad=vad,
+                fusion=fusion,
+                emotion_head=(emotion_head or DEFAULT_HEAD) if fusion == "whisper" else None,
+            )
+            cached = cache.get(cache_key)
+        if cached is not None:
+            print("[CACHE] Reusing stored analysis")
+            return _from_cache(cached)
+
+    # With window_s the voice model needs one window at a time, so a file
+    # path is streamed through it (iter_windows) and ASR decodes on its own;
+    # the full waveform is then not held for the whole analysis
+    if not (window_s and not vad and isinstance(audio, (str, os.PathLike))):
+        with trace_stage(tracer, "decode"):
+            audio = load_audio(audio)
+
+    speech_map = None
+    if vad:
+        with trace_stage(tracer, "vad"):
+            speech_map = detect_speech(audio, method=vad)
+        if speech_map.speech_samples:
+            audio = speech_map.speech_audio(audio)
+            print(f"[VAD] Skipping {speech_map.skipped_fraction:.0%} of the audio as non-speech")
+        else:
+            print("[VAD] No speech detected, using the full recording")
+            speech_map = None
+
+    if fusion not in (None, "late", "whisper"):
+        raise ValueError(f"Unknown fusion mode '{fusion}', expected 'late' or 'whisper'")
+    head = None
+    if fusion == "whisper":
+        from fuusio import get_head
+        head = get_head(emotion_head)
+
+    if not parallel:
+        with trace_stage(tracer, "model_load"):
+            preload(model_size, force_language, asr_options.get("engine"), asr_options.get("cpu_threads"))
+            if head is None:
+                get_audio_classifier()
+            else:
+                preload(head.whisper_model, engine="whisper")
+            get_text_classifier()
+        asr = transcribe_audio(audio, model_size=model_size, force_language=force_language,
+                               return_details=True, tracer=tracer, **asr_options)
+        if speech_map and segments:
+            _remap(asr[3]["segments"], speech_map)
+        if head is None:
+            audio_emo = _audio_task(audio, window_s, hop_s, tracer)
+        else:
+            audio_emo = _head_task(head, audio, tracer)
+        text_emo = _text_task(asr[0], asr[3]["segments"] if segments else None, tracer)
+    else:
+        if engine == "ctranslate2":
+            # CTranslate2 has its own thread pool, so ASR and emotion can get
+            # separate shares of the total
+            asr_threads, emo_threads = default_thread_budgets(threads)
+            asr_options.setdefault("cpu_threads", asr_threads)
+            _set_torch_threads(emo_threads)
+        else:
+            # Whisper and the emotion models share torch's one process-wide
+            # setting and run concurrently, so each op gets half of the total;
+            # there is no per-model split to make
+            asr_options.pop("cpu_threads", None)
+            _set_torch_threads(max(1, (threads or os.cpu_count() or 1) // 2))
+
+        pool = _executor()
+        with trace_stage(tracer, "model_load"):
+            # Independent models load concurrently
+            loads = [pool.submit(preload, model_size, force_language, asr_options.get("engine"),
+                                 asr_options.get("cpu_threads"))]
+            if head is None:
+                loads.append(pool.submit(get_audio_classifier))
+            else:
+                loads.append(pool.submit(preload, head.whisper_model, engine="whisper"))
+            get_text_classifier()
+            for future in loads:
+                future.result()
+
+        asr_future = pool.submit(transcribe_audio, audio,
+                                 model_size=model_size, force_language=force_language,
+                                 return_details=True, tracer=tracer, **asr_options)
+        if head is None:
+            audio_future = pool.submit(_audio_task, audio, window_s, hop_s, tracer)
+        else:
+            audio_future = pool.submit(_head_task, head, audio, tracer)
+
+        # Text emotion only needs the transcript; start it as soon as Whisper is done
+        asr = asr_future.result()
+        if speech_map and segments:
+            _remap(asr[3]["segments"], speech_map)
+        text_future = pool.submit(_text_task, asr[0], asr[3]["segments"] if segments else None, tracer)
+        audio_emo = audio_future.result()
+        text_emo = text_future.result()
+
+    if debug:
+        print_debug(audio_emo[2], text_emo[2])
+
+    *audio_emo, timeline = audio_emo
+    *text_emo, segment_emotions = text_emo
+    result = result_dict(asr[:3], audio_emo, text_emo)
+    result["language_source"] = asr[3]["language_source"]
+    if asr[3].get("tiers"):
+        result["asr_tiers"] = asr[3]["tiers"]
+    if timeline is not None:
+        if speech_map:
+            _remap(timeline, speech_map)
+        result["audio_timeline"] = timeline
+    if segment_emotions is not None:
+        result["text_segments"] = segment_emotions
+    if fusion:
+        add_fusion(result)
+    if speech_map:
+        result["vad"] = {
+            "method": vad,
+            "skipped_fraction": speech_map.skipped_fraction,
+            "speech_regions": speech_map.regions_s(),
+        }
+    if cache_key is not None:
+        cache.put(cache_key, result)
+    if tracer is not None:
+        result["trace"] = tracer.summary()
+    return result
@@ -0,0 +1,266 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+from ääni import SAMPLE_RATE, load_audio
+from puhe import detect_speech
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".m4a")
+
+_DONE = object()
+
+def iter_inputs(source: str):
+    # A directory is scanned recursively; any other file is a manifest with one path per line
+    if os.path.isdir(source):
+        for root, _, files in sorted(os.walk(source)):
+            for name in sorted(files):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    yield os.path.join(root, name)
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line if os.path.isabs(line) else os.path.join(base, line)
+
+def load_checkpoint(path: str) -> set:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+# Sinks return the rows they have durably written from write() and close();
+# run_batch checkpoints only those, so a killed run never skips unsaved rows
+
+class JsonlSink:
+    def __init__(self, path: str):
+        self.f = open(path, "a", encoding="utf-8")
+
+    def write(self, row: dict):
+        self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.f.flush()
+        return [row]
+
+    def close(self):
+        self.f.close()
+        return []
+
+def _row_schema():
+    # Pinned so a column that is all None in one part file keeps its type
+    import pyarrow as pa
+    predictions = pa.list_(pa.struct([("label", pa.string()), ("score", pa.float64())]))
+    return pa.schema([
+        ("path", pa.string()),
+        ("recorded_at", pa.float64()),
+        ("analyzed_at", pa.float64()),
+        ("duration_s", pa.float64()),
+        ("transcript", pa.string()),
+        ("detected_lang", pa.string()),
+        ("whisper_lang", pa.string()),
+        ("audio_label", pa.string()),
+        ("audio_score", pa.float64()),
+        ("audio_predictions", predictions),
+        ("text_label", pa.string()),
+        ("text_score", pa.float64()),
+        ("text_predictions", predictions),
+        ("timings", pa.struct([(name, pa.float64()) for name in
+                               ("asr_s", "audio_emotion_s", "text_emotion_s", "decode_s", "total_s")])),
+        ("vad_skipped_fraction", pa.float64()),
+    ])
+
+class ParquetSink:
+    # Every row group is written as its own complete part file (footer
+    # included), so whatever has been checkpointed can be read back after a
+    # crash: out.parquet, out.1.parquet, out.2.parquet, ...
+    def __init__(self, path: str, row_group_size: int = 256):
+        try:
+            import pyarrow  # noqa: F401
+            import pyarrow.parquet  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)") from e
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.schema = _row_schema()
+        self.part = 0
+
+    def _next_path(self):
+        stem, ext = os.path.splitext(self.path)
+        while True:
+            path = self.path if self.part == 0 else f"{stem}.{self.part}{ext}"
+            self.part += 1
+            if not os.path.exists(path):
+                return path
+
+    def write(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            return self._flush()
+        return []
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self.rows:
+            return []
+        table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        path = self._next_path()
+        tmp = f"{path}.tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        return self._flush()
+
+def open_sink(path: str):
+    if path.endswith(".parquet"):
+        return ParquetSink(path)
+    if path.endswith(".store") or os.path.isdir(path):
+        from tulokset import ResultStore
+        return ResultStore(path)
+    return JsonlSink(path)
+
+def _predictions(preds):
+    return [{"label": lbl, "score": float(sc)} for lbl, sc in preds]
+
+# Worker process state: models are loaded once per process by the initializer
+_WORKER = {}
+
+def _init_worker(model_size, force_language, threads, asr_options):
+    import torch
+    torch.set_num_threads(threads)
+    from kuiskaus import transcribe_audio
+    from tunne import detect_audio_emotion, detect_text_emotion
+    _WORKER.update(
+        model_size=model_size,
+        force_language=force_language,
+        asr_options=asr_options,
+        transcribe_audio=transcribe_audio,
+        detect_audio_emotion=detect_audio_emotion,
+        detect_text_emotion=detect_text_emotion,
+    )
+    # Load every model now so the first file does not pay for it
+    from mallit import MODEL_CACHE
+    from kuiskaus import preload
+    from tunne import audio_cache_key, text_cache_key
+    # preload resolves the engine ($ASR_ENGINE by default) the same way transcribe_audio does
+    preload(model_size, force_language, asr_options.get("engine"), asr_options.get("cpu_threads"))
+    MODEL_CACHE.warm_up([audio_cache_key(), text_cache_key()], background=False)
+
+def _process(audio):
+    from analyysi import result_dict
+    t0 = time.perf_counter()
+    asr = _WORKER["transcribe_audio"](audio, model_size=_WORKER["model_size"], force_language=_WORKER["force_language"],
+                                   **_WORKER["asr_options"])
+    t1 = time.perf_counter()
+    audio_emo = _WORKER["detect_audio_emotion"](audio)
+    t2 = time.perf_counter()
+    text_emo = _WORKER["detect_text_emotion"](asr[0])
+    t3 = time.perf_counter()
+    result = result_dict(asr, audio_emo, text_emo)
+    result["audio_predictions"] = _predictions(result["audio_predictions"])
+    result["text_predictions"] = _predictions(result["text_predictions"])
+    result["timings"] = {"asr_s": t1 - t0, "audio_emotion_s": t2 - t1, "text_emotion_s": t3 - t2}
+    return result
+
+def _prefetch(paths, out_queue, stop, vad=None):
+    # Decoding (and VAD) runs ahead of inference but never more than the queue size
+    for path in paths:
+        if stop.is_set():
+            break
+        t0 = time.perf_counter()
+        audio, n_samples, skipped, error = None, 0, None, None
+        try:
+            audio = load_audio(path)
+            n_samples = len(audio)
+            if vad:
+                speech_map = detect_speech(audio, method=vad)
+                if speech_map.speech_samples:
+                    audio, skipped = speech_map.speech_audio(audio), speech_map.skipped_fraction
+        except Exception as e:
+            error = str(e)
+        out_queue.put((path, audio, n_samples, skipped, time.perf_counter() - t0, error))
+    out_queue.put(_DONE)
+
+def _checkpoint(ckpt, rows):
+    # Only rows the sink reports as written; buffered ones come back later
+    for row in rows or []:
+        ckpt.write(row["path"] + "\n")
+    ckpt.flush()
+
+def run_batch(source: str, output: str, model_size: str = "small", force_language: str = None,
+              workers: int = 2, prefetch: int = 8, checkpoint: str = None, asr_options: dict = None,
+              vad: str = None):
+    checkpoint = checkpoint or f"{output}.done"
+    done = load_checkpoint(checkpoint)
+    paths = [p for p in iter_inputs(source) if p not in done]
+    print(f"[BATCH] {len(paths)} files to process ({len(done)} already done)")
+    if not paths:
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    sink = open_sink(output)
+    stop = threading.Event()
+    decoded = queue.Queue(maxsize=prefetch)
+    reader = threading.Thread(target=_prefetch, args=(paths, decoded, stop, vad), daemon=True)
+    reader.start()
+
+    started = time.perf_counter()
+    processed = 0
+    pending = {}
+    exhausted = False
+    ckpt = open(checkpoint, "a", encoding="utf-8")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 initializer=_init_worker, initargs=(model_size, force_language, threads, asr_options or {})) as pool:
+            while pending or not exhausted:
+                # Keep every worker busy plus one queued item each
+                while not exhausted and len(pending) < workers * 2:
+                    item = decoded.get()
+                    if item is _DONE:
+                        exhausted = True
+                        break
+                    path, audio, n_samples, skipped, decode_s, error = item
+                    if error:
+                        # Not checkpointed, so a resumed run retries it
+                        print(f"[BATCH] {path}: decode failed: {error}")
+                        continue
+                    future = pool.submit(_process, audio)
+                    pending[future] = (path, decode_s, n_samples, skipped, time.perf_counter())
+
+                if not pending:
+                    continue
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, decode_s, n_samples, skipped, submitted = pending.pop(future)
+                    try:
+                        row = future.result()
+                    except Exception as e:
+                        print(f"[BATCH] {path}: failed: {e}")
+                        continue
+                    row["timings"]["decode_s"] = decode_s
+                    row["timings"]["total_s"] = decode_s + time.perf_counter() - submitted
+                    row = {"path": path, "recorded_at": os.path.getmtime(path), "analyzed_at": time.time(),
+                           "duration_s": n_samples / SAMPLE_RATE, **row}
+                    if skipped is not None:
+                        row["vad_skipped_fraction"] = skipped
+                    _checkpoint(ckpt, sink.write(row))
+                    processed += 1
+                    t = row["timings"]
+                    print(f"[BATCH] {path}: decode {t['decode_s']:.2f}s | asr {t['asr_s']:.2f}s | "
+                          f"audio emo {t['audio_emotion_s']:.2f}s | text emo {t['text_emotion_s']:.2f}s")
+    finally:
+        stop.set()
+        # Rows still buffered in the sink are written (and checkpointed) now
+        _checkpoint(ckpt, sink.close())
+        ckpt.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"[BATCH] Processed {processed} files in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.2f} files/s)")
@@ -0,0 +1,150 @@
+import argparse
+import os
+
+import numpy as np
+
+from mallit import MODEL_CACHE
+from tunne import AUDIO_LABELS, TEXT_LABELS, _audio_label, score_vector
+
+# The text model's seven labels are the common space; each voice label is
+# spread over the text labels it is acoustically confused with
+FUSED_LABELS = TEXT_LABELS
+AUDIO_TO_FUSED = np.array([
+    # anger disgust fear  joy  neutral sadness surprise
+    [0.80, 0.20, 0.00, 0.00, 0.00, 0.00, 0.00],  # angry
+    [0.00, 0.00, 0.00, 0.85, 0.00, 0.00, 0.15],  # happy
+    [0.00, 0.00, 0.00, 0.00, 1.00, 0.00, 0.00],  # neutral
+    [0.00, 0.00, 0.15, 0.00, 0.00, 0.85, 0.00],  # sad
+], dtype=np.float32)
+
+DEFAULT_AUDIO_WEIGHT = float(os.environ.get("EMOTION_AUDIO_WEIGHT", "0.5"))
+DEFAULT_HEAD = os.environ.get("EMOTION_HEAD")
+
+def fuse(audio_probs, text_probs, audio_weight=DEFAULT_AUDIO_WEIGHT):
+    # audio_probs (n, 4) in AUDIO_LABELS order, text_probs (n, 7) in
+    # TEXT_LABELS order -> (n, 7) fused distribution. audio_weight is a scalar
+    # or one weight per row (e.g. lower for calls with little speech).
+    audio_probs = np.atleast_2d(np.asarray(audio_probs, dtype=np.float32))
+    text_probs = np.atleast_2d(np.asarray(text_probs, dtype=np.float32))
+    weight = np.asarray(audio_weight, dtype=np.float32).reshape(-1, 1)
+    # The audio pipeline may return only its top-k labels; renormalize both sides
+    audio = audio_probs / np.maximum(audio_probs.sum(axis=1, keepdims=True), 1e-9)
+    text = text_probs / np.maximum(text_probs.sum(axis=1, keepdims=True), 1e-9)
+    return weight * (audio @ AUDIO_TO_FUSED) + (1.0 - weight) * text
+
+def _predictions(fused_row):
+    order = np.argsort(fused_row)[::-1]
+    return [(FUSED_LABELS[i], float(fused_row[i])) for i in order]
+
+def fuse_results(results, audio_weight=DEFAULT_AUDIO_WEIGHT):
+    # analyze()-style result dicts -> one (label, score, predictions) per result
+    if not results:
+        return []
+    audio = np.stack([score_vector(r["audio_predictions"], AUDIO_LABELS) for r in results])
+    text = np.stack([score_vector(r["text_predictions"], TEXT_LABELS) for r in results])
+    fused = fuse(audio, text, audio_weight)
+    out = []
+    for row in fused:
+        predictions = _predictions(row)
+        out.append((predictions[0][0], predictions[0][1], predictions))
+    return out
+
+def add_fusion(result: dict, audio_weight=DEFAULT_AUDIO_WEIGHT) -> dict:
+    label, score, predictions = fuse_results([result], audio_weight)[0]
+    result.update(fused_label=label, fused_score=score, fused_predictions=predictions)
+    return result
+
+class EmbeddingHead:
+    # Linear softmax head over pooled Whisper encoder embeddings, standing in
+    # for the wav2vec2 voice model. Stored as .npz: weights (d, k), bias (k,),
+    # labels (k,) drawn from AUDIO_LABELS, and the Whisper model it was fitted on.
+    def __init__(self, weights, bias, labels, whisper_model: str):
+        unknown = set(labels) - set(AUDIO_LABELS)
+        if unknown:
+            raise ValueError(f"Head labels {sorted(unknown)} are not audio labels {AUDIO_LABELS}")
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = tuple(labels)
+        self.whisper_model = whisper_model
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["weights"], data["bias"], [str(lbl) for lbl in data["labels"]],
+                       str(data["whisper_model"]))
+
+    def save(self, path: str):
+        np.savez(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels),
+                 whisper_model=np.array(self.whisper_model))
+
+    def predict(self, embeddings) -> np.ndarray:
+        # (n, d) -> (n, 4) probabilities in AUDIO_LABELS order
+        logits = np.atleast_2d(np.asarray(embeddings, dtype=np.float32)) @ self.weights + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        out = np.zeros((len(probs), len(AUDIO_LABELS)), dtype=np.float32)
+        out[:, [AUDIO_LABELS.index(lbl) for lbl in self.labels]] = probs
+        return out
+
+    def audio_emotion(self, embedding):
+        # Same triple as tunne.detect_audio_emotion
+        probs = self.predict(embedding)[0]
+        predictions = sorted(zip(AUDIO_LABELS, probs.tolist()), key=lambda x: x[1], reverse=True)
+        final_label, top_score = _audio_label(predictions)
+        return final_label, top_score, predictions
+
+def fit_head(embeddings, labels, whisper_model: str, C: float = 1.0) -> EmbeddingHead:
+    try:
+        from sklearn.linear_model import LogisticRegression
+    except ImportError as e:
+        raise RuntimeError("Fitting a head requires scikit-learn (pip install scikit-learn)") from e
+    clf = LogisticRegression(C=C, max_iter=1000)
+    clf.fit(np.asarray(embeddings, dtype=np.float32), list(labels))
+    weights, bias = clf.coef_.T, clf.intercept_
+    if len(clf.classes_) == 2:
+        # Binary problems get a single logit; expand to two softmax columns
+        weights = np.concatenate([-weights / 2, weights / 2], axis=1)
+        bias = np.array([-bias[0] / 2, bias[0] / 2])
+    return EmbeddingHead(weights, bias, [str(c) for c in clf.classes_], whisper_model)
+
+MODEL_CACHE.register_family("head", lambda path, device, precision: EmbeddingHead.load(path))
+
+def head_cache_key(path: str):
+    return (f"head/{os.path.abspath(path)}", "cpu", "fp32")
+
+def get_head(path: str = None):
+    path = path or DEFAULT_HEAD
+    if not path:
+        raise RuntimeError("No embedding head configured (pass --emotion_head or set EMOTION_HEAD)")
+    return MODEL_CACHE.get(*head_cache_key(path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit a Whisper-embedding emotion head")
+    parser.add_argument("--labels", type=str, required=True,
+                        help="CSV of path,label lines; labels must be one of " + ", ".join(AUDIO_LABELS))
+    parser.add_argument("--model_size", type=str, default="small")
+    parser.add_argument("--out", type=str, default="emotion_head.npz")
+    parser.add_argument("--C", type=float, default=1.0)
+    args = parser.parse_args()
+
+    from kuiskaus import encoder_embedding, model_tiers
+    if len(model_tiers(args.model_size)) > 1:
+        parser.error("--model_size must name one Whisper model; the head is tied to its encoder")
+
+    base = os.path.dirname(os.path.abspath(args.labels))
+    embeddings, labels = [], []
+    with open(args.labels, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path, _, label = line.rpartition(",")
+            path = path if os.path.isabs(path) else os.path.join(base, path)
+            embeddings.append(encoder_embedding(path, args.model_size))
+            labels.append(label.strip())
+            print(f"[HEAD] {path}: {label.strip()}")
+
+    head = fit_head(np.stack(embeddings), labels, args.model_size, C=args.C)
+    head.save(args.out)
+    print(f"[HEAD] Saved {len(head.labels)}-label head for whisper {args.model_size} to {args.out}")
@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from mallit import rss_bytes
+
+class Tracer:
+    # Records wall time, CPU time and peak RSS per pipeline stage. CPU time is
+    # process-wide (torch runs its own threads), so overlapping stages in
+    # parallel mode each see the other's CPU use. on_stage(span) is called as
+    # each stage finishes, e.g. to drive a progress bar.
+    def __init__(self, on_stage=None, sample_interval_s: float = 0.01):
+        self.on_stage = on_stage
+        self.spans = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._interval = sample_interval_s
+        self._sampler = None
+
+    def _sample(self):
+        while True:
+            rss = rss_bytes()
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                for span in self._open:
+                    span["_peak"] = max(span["_peak"], rss)
+            time.sleep(self._interval)
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        rss = rss_bytes()
+        span = {"stage": name, **labels, "_peak": rss}
+        with self._lock:
+            self._open.append(span)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="tracer-rss", daemon=True)
+                self._sampler.start()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield span
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            end_rss = rss_bytes()
+            with self._lock:
+                self._open.remove(span)
+                peak = max(span.pop("_peak"), end_rss)
+                span.update({
+                    "wall_s": wall,
+                    "cpu_s": cpu,
+                    "rss_start_mb": rss / 2**20,
+                    "rss_peak_mb": peak / 2**20,
+                    "rss_delta_mb": (peak - rss) / 2**20,
+                })
+                self.spans.append(span)
+            if self.on_stage:
+                self.on_stage(span)
+
+    def summary(self):
+        with self._lock:
+            return [dict(span) for span in self.spans]
+
+    def to_jsonl(self, f, **extra):
+        for span in self.summary():
+            f.write(json.dumps({**extra, **span}) + "\n")
+
+    def to_prometheus(self, prefix: str = "emotion_asr", **labels) -> str:
+        # Prometheus text exposition format, one gauge family per figure
+        metrics = (("wall_s", "stage_wall_seconds", "Wall-clock time per stage"),
+                   ("cpu_s", "stage_cpu_seconds", "Process CPU time per stage"),
+                   ("rss_peak_mb", "stage_peak_rss_megabytes", "Peak resident memory during stage"))
+        lines = []
+        spans = self.summary()
+        for field, name, help_text in metrics:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for span in spans:
+                span_labels = {**labels, "stage": span["stage"]}
+                label_str = ",".join(f'{k}="{v}"' for k, v in span_labels.items())
+                lines.append(f"{prefix}_{name}{{{label_str}}} {span[field]:.6f}")
+        return "\n".join(lines) + "\n"
+
+def trace_stage(tracer, name: str, **labels):
+    # tracer is optional everywhere; without one this is a no-op context
+    return tracer.stage(name, **labels) if tracer is not None else nullcontext()
@@ -1,31 +1,505 @@
-import whisper
-from langdetect import detect, DetectorFactory
-DetectorFactory.seed = 0
-_MODEL_CACHE = {}
+import atexit
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from mallit import MODEL_CACHE
+from jäljitys import trace_stage
+from ääni import SAMPLE_RATE, load_audio
+
+# Whisper models share the process-wide registry with the emotion models
+_MODEL_CACHE = MODEL_CACHE
+
+# whisper (and with it torch) is imported on first use, not at import
+def _load_whisper_model(name, device, precision):
+    import whisper
+    return whisper.load_model(name, device=device)
+
+_MODEL_CACHE.register_family("whisper", _load_whisper_model)
+
+def whisper_device():
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    # whisper decodes in fp16 on GPU and fp32 on CPU
+    return device, ("fp16" if device == "cuda" else "fp32")
+
+def whisper_cache_key(model_name: str):
+    return (f"whisper/{model_name}", *whisper_device())
+
 def _load_whisper(model_name: str):
-    if model_name not in _MODEL_CACHE:
-        print(f"[INFO] Loading Whisper model: {model_name} (this may take a moment)...")
-        _MODEL_CACHE[model_name] = whisper.load_model(model_name)
-    return _MODEL_CACHE[model_name]
+    return _MODEL_CACHE.get(*whisper_cache_key(model_name))
+
+def _segments(result):
+    return [
+        {
+            "start": float(seg["start"]),
+            "end": float(seg["end"]),
+            "text": seg["text"].strip(),
+            "avg_logprob": float(seg.get("avg_logprob", 0.0)),
+            "no_speech_prob": float(seg.get("no_speech_prob", 0.0)),
+            "compression_ratio": float(seg.get("compression_ratio", 0.0)),
+        }
+        for seg in result.get("segments", [])
+    ]
+
+# CTranslate2 Whisper (faster-whisper) in int8; cpu_threads is fixed when the
+# model is built, so it is part of the cached model name ("small:4")
+def _load_ct2(name, device, precision):
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError as e:
+        raise RuntimeError("The ctranslate2 engine requires faster-whisper (pip install faster-whisper)") from e
+    model_name, _, threads = name.partition(":")
+    return WhisperModel(model_name, device=device, compute_type=precision, cpu_threads=int(threads or 0))
+
+_MODEL_CACHE.register_family("ct2", _load_ct2)
+
+def _whisper_language(model, audio):
+    # Same first-30s language pass transcribe() would run, but keeping the
+    # probability; the chosen language is then passed on so it is not repeated
+    import whisper
+    if not model.is_multilingual:
+        return "en", 1.0
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    language = max(probs, key=probs.get)
+    return language, float(probs[language])
+
+def _content_frames(mel):
+    # Encoder frames (half the mel frames) that hold audio rather than padding:
+    # pad_or_trim and whisper's own padding give mel columns flat at the floor
+    flat = (mel.amax(dim=-2) - mel.amin(dim=-2)) < 1e-6
+    return ~(flat[..., 0::2] & flat[..., 1::2])
+
+def encoder_embedding(audio, model_size: str = "small", force_language: str = None) -> np.ndarray:
+    # Mean encoder output over the content frames of fixed, non-overlapping
+    # 30 s windows. Fitting a head (fuusio.py) and applying it (analyze with
+    # fusion="whisper") both pool here, so a head always sees the features,
+    # and the Whisper model, it was fitted on.
+    import torch
+    import whisper
+    audio = load_audio(audio)
+    model = _load_whisper(_model_name(model_size, force_language))
+    chunk = whisper.audio.N_SAMPLES
+    total, count = None, 0
+    with torch.no_grad():
+        for start in range(0, max(len(audio), 1), chunk):
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio[start:start + chunk]),
+                                              n_mels=model.dims.n_mels).to(model.device)[None]
+            output = model.embed_audio(mel)
+            keep = _content_frames(mel)[..., :output.shape[1]].unsqueeze(-1).to(output.dtype)
+            window = (output * keep).sum(dim=(0, 1)).float().cpu().numpy()
+            total = window if total is None else total + window
+            count += int(keep.sum())
+    return (total / max(count, 1)).astype(np.float32)
+
+def _transcribe_whisper(audio, model_name, beam_size=None, vad_filter=False, cpu_threads=None, language=None):
+    # vad_filter is not supported by openai-whisper and is ignored here.
+    # cpu_threads sets torch's process-wide thread count, which the emotion
+    # models in the same process share; analyze() sets it once instead
+    if cpu_threads:
+        import torch
+        torch.set_num_threads(cpu_threads)
+    model = _load_whisper(model_name)
+    _, precision = whisper_device()
+    options = {"fp16": precision == "fp16"}
+    if beam_size:
+        options["beam_size"] = beam_size
+    probability = None
+    if language is None:
+        if not isinstance(audio, np.ndarray):
+            audio = load_audio(audio)
+        language, probability = _whisper_language(model, audio)
+    result = model.transcribe(audio, language=language, **options)
+    result["language_probability"] = probability
+    return result
 
-def transcribe_audio(audio_path: str, model_size: str = "small", force_language: str = None):
+def _load_ct2_cached(model_name, cpu_threads=None):
+    return _MODEL_CACHE.get(f"ct2/{model_name}:{cpu_threads or 0}", "cpu", "int8")
+
+def _transcribe_ct2(audio, model_name, beam_size=None, vad_filter=False, cpu_threads=None, language=None):
+    model = _load_ct2_cached(model_name, cpu_threads)
+    segments, info = model.transcribe(audio, beam_size=beam_size or 5, vad_filter=vad_filter, language=language)
+    segments = [
+        {"start": seg.start, "end": seg.end, "text": seg.text,
+         "avg_logprob": seg.avg_logprob, "no_speech_prob": seg.no_speech_prob,
+         "compression_ratio": seg.compression_ratio}
+        for seg in segments
+    ]
+    return {"text": "".join(seg["text"] for seg in segments), "language": info.language,
+            "language_probability": None if language else info.language_probability, "segments": segments}
+
+# Every engine returns a whisper-style result dict: {"text", "language", "segments"}
+# plus "language_probability" (None when the language was given)
+ENGINES = {
+    "whisper": _transcribe_whisper,
+    "ctranslate2": _transcribe_ct2,
+}
+DEFAULT_ENGINE = os.environ.get("ASR_ENGINE", "whisper")
+
+def _model_name(model_size: str, force_language: str = None) -> str:
     model_name = model_size
     if force_language:
         if force_language.lower() == "en":
             model_name = f"{model_size}.en"
+    return model_name
 
-    model = _load_whisper(model_name)
-    result = model.transcribe(audio_path)
-    text = result.get("text", "").strip()
-    whisper_lang = result.get("language", None)
+# Tiered transcription: model_size "auto" (tiers from $ASR_TIERS) or an
+# explicit list such as "tiny,medium". The first tier transcribes the whole
+# file; segments that fail the confidence thresholds are transcribed again
+# with the next tier.
+DEFAULT_TIERS = tuple(t.strip() for t in os.environ.get("ASR_TIERS", "base,small").split(","))
+TIER_MIN_LOGPROB = float(os.environ.get("ASR_TIER_MIN_LOGPROB", "-0.7"))
+TIER_MAX_NO_SPEECH = float(os.environ.get("ASR_TIER_MAX_NO_SPEECH", "0.5"))
+# Repetitive output (whisper's own fallback threshold)
+TIER_MAX_COMPRESSION = 2.4
+# Past this share of low-confidence audio the whole file is redone in one pass
+TIER_FULL_FRACTION = 0.5
+
+def model_tiers(model_size: str):
+    if model_size == "auto":
+        return DEFAULT_TIERS
+    return tuple(t.strip() for t in model_size.split(","))
+
+def whisper_cache_keys(model_size: str, force_language: str = None):
+    return [whisper_cache_key(_model_name(tier, force_language)) for tier in model_tiers(model_size)]
+
+def preload(model_size: str = "small", force_language: str = None, engine: str = None, cpu_threads: int = None):
+    # Loads the model(s) transcribe_audio would use, so callers can time the load separately
+    for tier in model_tiers(model_size):
+        model_name = _model_name(tier, force_language)
+        if (engine or DEFAULT_ENGINE) == "ctranslate2":
+            _load_ct2_cached(model_name, cpu_threads)
+        else:
+            _load_whisper(model_name)
+
+_TIER_LOCK = threading.Lock()
+_TIER_STATS = {"files": 0, "escalated_files": 0, "segments": 0, "escalated_segments": 0,
+               "audio_s": 0.0, "escalated_s": 0.0}
+
+def tier_stats():
+    # Process-wide escalation figures for tiered transcription
+    with _TIER_LOCK:
+        stats = dict(_TIER_STATS)
+    stats["escalation_rate"] = stats["escalated_s"] / stats["audio_s"] if stats["audio_s"] else 0.0
+    return stats
+
+def _record_tiers(info, duration):
+    # First escalation only: that is what the cheap tier could not handle
+    first = [e for e in info["escalations"] if e["model"] == info["models"][1]] if len(info["models"]) > 1 else []
+    seconds = min(sum(e["seconds"] for e in first), duration)
+    info["escalation_rate"] = seconds / duration if duration else 0.0
+    with _TIER_LOCK:
+        _TIER_STATS["files"] += 1
+        _TIER_STATS["segments"] += info["segments"]
+        _TIER_STATS["audio_s"] += duration
+        if first:
+            _TIER_STATS["escalated_files"] += 1
+            _TIER_STATS["escalated_segments"] += sum(e["segments"] for e in first)
+            _TIER_STATS["escalated_s"] += seconds
+
+def _confident(seg, min_logprob, max_no_speech):
+    return (seg.get("avg_logprob", 0.0) >= min_logprob
+            and seg.get("no_speech_prob", 0.0) <= max_no_speech
+            and seg.get("compression_ratio", 0.0) <= TIER_MAX_COMPRESSION)
+
+def _low_spans(segments, ok, duration):
+    # Runs of rejected segments as (first, stop, start_s, end_s); each run
+    # reaches to the edges of its accepted neighbours so no audio is lost
+    spans, i = [], 0
+    while i < len(segments):
+        if ok[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(segments) and not ok[j]:
+            j += 1
+        start = segments[i - 1]["end"] if i > 0 else 0.0
+        end = segments[j]["start"] if j < len(segments) else duration
+        spans.append((i, j, start, max(start, end)))
+        i = j
+    return spans
+
+def _transcribe_tiered(run, audio, tiers, force_language, min_logprob, max_no_speech, language=None, **options):
+    # language: already decided by the caller (e.g. once per chunked recording);
+    # unlike force_language it does not pick the .en models
+    audio = load_audio(audio)
+    duration = len(audio) / SAMPLE_RATE
+    given = language or force_language
+    result = run(audio, _model_name(tiers[0], force_language), language=given, **options)
+    # Segment re-runs reuse the language found so far instead of detecting again
+    language = given or result.get("language")
+    segments = list(result.get("segments", []))
+    info = {"models": [tiers[0]], "segments": len(segments), "escalations": []}
 
-    detected_lang = None
+    for tier in tiers[1:]:
+        ok = [_confident(seg, min_logprob, max_no_speech) for seg in segments]
+        if all(ok):
+            break
+        spans = _low_spans(segments, ok, duration)
+        low_s = sum(end - start for _, _, start, end in spans)
+        model_name = _model_name(tier, force_language)
+        info["models"].append(tier)
+        info["escalations"].append({"model": tier, "segments": ok.count(False), "seconds": low_s,
+                                    "full": low_s >= TIER_FULL_FRACTION * duration})
+        if low_s >= TIER_FULL_FRACTION * duration:
+            # A full redo replaces the first pass entirely: its own language
+            # detection and probability are what the file reports
+            result = run(audio, model_name, language=given, **options)
+            language = given or result.get("language")
+            segments = list(result.get("segments", []))
+            continue
+        merged, prev = [], 0
+        for first, stop, start, end in spans:
+            merged.extend(segments[prev:first])
+            prev = stop
+            if end - start < 0.1:
+                merged.extend(segments[first:stop])
+                continue
+            part = run(audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], model_name,
+                       language=language, **options)
+            for seg in part.get("segments", []):
+                merged.append({**seg, "start": seg["start"] + start, "end": min(seg["end"] + start, end)})
+        merged.extend(segments[prev:])
+        segments = merged
+
+    _record_tiers(info, duration)
+    return {
+        "text": "".join(seg["text"] for seg in segments),
+        "language": language,
+        "language_probability": result.get("language_probability"),
+        "segments": segments,
+        "tiers": info,
+    }
+
+def _run_engine(audio, model_size, force_language, engine, tier_min_logprob=TIER_MIN_LOGPROB,
+                tier_max_no_speech=TIER_MAX_NO_SPEECH, language=None, **options):
+    # One whisper-style result dict, tiered or single-model
+    tiers = model_tiers(model_size)
+    if len(tiers) > 1:
+        return _transcribe_tiered(ENGINES[engine], audio, tiers, force_language, tier_min_logprob,
+                                  tier_max_no_speech, language=language, **options)
+    return ENGINES[engine](audio, _model_name(model_size, force_language), language=language or force_language,
+                           **options)
+
+# Chunked transcription: long recordings are cut at quiet points roughly
+# every chunk_s seconds and the chunks are transcribed in a spawn process
+# pool, each worker with its own torch thread budget. Chunks overlap by
+# CHUNK_OVERLAP_S; each chunk keeps only the segments centred in its own
+# span, so nothing is transcribed twice in the output.
+#
+# Every worker loads its own copy of the model(s) into its own MODEL_CACHE,
+# on top of any copy this process holds; MODEL_CACHE_MAX_MB applies per
+# process, so the worker count is capped to keep all the copies under it.
+CHUNK_OVERLAP_S = 1.0
+CHUNK_SEARCH_S = 10.0
+DEFAULT_CHUNK_WORKERS = int(os.environ.get("ASR_CHUNK_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // 4)
+
+# Approximate resident size of the fp32 Whisper models on CPU (MB);
+# CTranslate2 int8 models take about a quarter of that
+_WHISPER_MB = {"tiny": 150, "base": 290, "small": 970, "medium": 3060, "large": 6170, "turbo": 3240}
+
+def _model_mb(model_size: str, engine: str) -> float:
+    total = 0.0
+    for tier in model_tiers(model_size):
+        base = re.split(r"[.-]", tier)[0]
+        total += _WHISPER_MB.get(base, _WHISPER_MB["large"])
+    return total / 4 if engine == "ctranslate2" else total
+
+def _bounded_workers(workers, model_size, engine):
+    if not MODEL_CACHE.max_bytes:
+        return workers
+    # One copy here and one per worker
+    per_copy = _model_mb(model_size, engine)
+    fit = max(1, int(MODEL_CACHE.max_bytes / 2**20 // per_copy) - 1)
+    if fit < workers:
+        print(f"[ASR] Using {fit} chunk workers instead of {workers}: each holds ~{per_copy:.0f} MB "
+              f"of models and MODEL_CACHE_MAX_MB is {MODEL_CACHE.max_bytes / 2**20:.0f}")
+        return fit
+    return workers
+
+_CHUNK_POOL = None
+
+def _init_chunk_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+def shutdown_chunk_pool():
+    # Stops the chunk workers and frees their models; also run at exit
+    global _CHUNK_POOL
+    if _CHUNK_POOL is not None:
+        _CHUNK_POOL[1].shutdown(cancel_futures=True)
+        _CHUNK_POOL = None
+
+atexit.register(shutdown_chunk_pool)
+
+def _chunk_pool(workers, threads):
+    # Kept between calls so workers keep their models loaded
+    global _CHUNK_POOL
+    if _CHUNK_POOL is None or _CHUNK_POOL[0] != (workers, threads):
+        shutdown_chunk_pool()
+        _CHUNK_POOL = ((workers, threads), ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context("spawn"),
+            initializer=_init_chunk_worker, initargs=(threads,)))
+    return _CHUNK_POOL[1]
+
+def _chunk_worker(audio, model_size, force_language, engine, options):
+    return _run_engine(audio, model_size, force_language, engine, **options)
+
+def _detect_language(audio, model_name, engine):
+    # (language, probability) from the opening 30 s, as a single pass would
+    if engine == "ctranslate2":
+        # faster-whisper detects the language before decoding; the segment
+        # generator is never consumed, so nothing is transcribed
+        _, info = _load_ct2_cached(model_name).transcribe(audio[:30 * SAMPLE_RATE])
+        return info.language, float(info.language_probability)
+    return _whisper_language(_load_whisper(model_name), audio)
+
+def _words(text):
+    return [re.sub(r"[^\w]", "", w.lower()) for w in text.split()]
+
+def _dedupe_words(previous: str, text: str, max_words: int = 8) -> str:
+    # Drops the longest run of leading words that repeats the end of the previous chunk
+    prev, cur = _words(previous)[-max_words:], _words(text)[:max_words]
+    for n in range(min(len(prev), len(cur)), 0, -1):
+        if prev[-n:] == cur[:n] and any(prev[-n:]):
+            return " ".join(text.split()[n:])
+    return text
+
+def _merge_tiers(infos):
+    infos = [info for info in infos if info]
+    if not infos:
+        return None
+    models = []
+    for info in infos:
+        models.extend(m for m in info["models"] if m not in models)
+    return {"models": models, "segments": sum(info["segments"] for info in infos),
+            "escalations": [e for info in infos for e in info["escalations"]]}
+
+def _transcribe_chunked(audio, model_size, force_language, engine, chunk_s, workers=None, **options):
+    from puhe import silence_boundaries
+    audio = load_audio(audio)
+    duration = len(audio) / SAMPLE_RATE
+    if duration <= 1.5 * chunk_s:
+        return _run_engine(audio, model_size, force_language, engine, **options)
+
+    # One language for the whole recording, detected once here instead of
+    # separately in every chunk
+    language, probability = force_language, None
+    if language is None:
+        language, probability = _detect_language(audio, _model_name(model_tiers(model_size)[0]), engine)
+
+    bounds = silence_boundaries(audio, chunk_s, CHUNK_SEARCH_S)
+    overlap = int(CHUNK_OVERLAP_S * SAMPLE_RATE)
+    workers = _bounded_workers(min(workers or DEFAULT_CHUNK_WORKERS, len(bounds) - 1), model_size, engine)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # Workers get their share of the cores, whatever the caller's budget was
+    options = {**options, "cpu_threads": threads, "language": language}
+    pool = _chunk_pool(workers, threads)
+    futures = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        start, end = max(0, lo - overlap), min(len(audio), hi + overlap)
+        futures.append((lo / SAMPLE_RATE, hi / SAMPLE_RATE, start / SAMPLE_RATE,
+                        pool.submit(_chunk_worker, audio[start:end], model_size, force_language, engine, options)))
+
+    segments, parts = [], []
+    for own_start, own_end, offset, future in futures:
+        part = future.result()
+        parts.append(part)
+        kept = []
+        for seg in part.get("segments", []):
+            seg = {**seg, "start": seg["start"] + offset, "end": seg["end"] + offset}
+            if own_start <= (seg["start"] + seg["end"]) / 2 < own_end:
+                kept.append(seg)
+        # A word cut by a boundary without silence can appear in both chunks
+        if segments and kept and kept[0]["start"] - segments[-1]["end"] < CHUNK_OVERLAP_S:
+            kept[0]["text"] = " " + _dedupe_words(segments[-1]["text"], kept[0]["text"])
+        segments.extend(seg for seg in kept if seg["text"].strip())
+
+    tiers = _merge_tiers([part.get("tiers") for part in parts])
+    if tiers:
+        _record_tiers(tiers, duration)
+    return {
+        "text": " ".join(seg["text"].strip() for seg in segments),
+        "language": language,
+        "language_probability": probability,
+        "segments": segments,
+        "chunks": len(parts),
+        "tiers": tiers,
+    }
+
+LANGUAGE_MIN_PROBABILITY = 0.8
+LANGUAGE_SAMPLE_CHARS = 400
+
+def _text_sample(text: str, max_chars: int = LANGUAGE_SAMPLE_CHARS) -> str:
+    # A bounded slice from the middle of the transcript, cut at word boundaries
+    if len(text) <= max_chars:
+        return text
+    start = (len(text) - max_chars) // 2
+    sample = text[start:start + max_chars]
+    return sample[sample.find(" ") + 1:sample.rfind(" ")] or sample
+
+def identify_language(text: str, whisper_lang: str = None, whisper_prob: float = None,
+                      force_language: str = None, min_prob: float = LANGUAGE_MIN_PROBABILITY):
+    # Returns (language, source). Source is "forced", "whisper" (confident
+    # audio-based ID, no text pass), "text" (langdetect on a bounded sample)
+    # or "whisper_fallback" (text detection impossible or failed)
+    if force_language:
+        return force_language, "forced"
+    if whisper_lang and whisper_prob is not None and whisper_prob >= min_prob:
+        return whisper_lang, "whisper"
     try:
-        if text and len(text) >= 6: 
-            detected_lang = detect(text)
+        if text and len(text) >= 6:
+            from langdetect import DetectorFactory, detect
+            DetectorFactory.seed = 0
+            return detect(_text_sample(text)), "text"
     except Exception:
-        detected_lang = None
-    if not detected_lang and whisper_lang:
-        detected_lang = whisper_lang
+        pass
+    return whisper_lang, "whisper_fallback"
+
+def transcribe_audio(audio, model_size: str = "small", force_language: str = None, return_details: bool = False,
+                     engine: str = None, beam_size: int = None, vad_filter: bool = False, cpu_threads: int = None,
+                     tracer=None, tier_min_logprob: float = TIER_MIN_LOGPROB,
+                     tier_max_no_speech: float = TIER_MAX_NO_SPEECH, chunk_s: float = None,
+                     chunk_workers: int = None):
+    # audio: file path or 16 kHz float32 waveform from load_audio
+    # return_details adds a fourth value: {"segments": [{"start", "end", "text", ...}],
+    #                                      "language_source", "language_probability"}
+    # model_size "auto" or "base,small" transcribes in tiers (see model_tiers);
+    # details then carry "tiers": models used and what was escalated
+    # chunk_s: split recordings longer than 1.5 x chunk_s at quiet points and
+    # transcribe the chunks in parallel processes (chunk_workers, default
+    # $ASR_CHUNK_WORKERS or a quarter of the cores, capped by MODEL_CACHE_MAX_MB)
+
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown ASR engine '{engine}', expected one of {sorted(ENGINES)}")
+    if vad_filter and engine != "ctranslate2":
+        print("[ASR] vad_filter is only supported by the ctranslate2 engine; ignoring it")
+        vad_filter = False
+    forced = force_language.lower() if force_language else None
+    with trace_stage(tracer, "whisper", engine=engine, model=model_size):
+        options = {"tier_min_logprob": tier_min_logprob, "tier_max_no_speech": tier_max_no_speech,
+                   "beam_size": beam_size, "vad_filter": vad_filter,
+                   "cpu_threads": cpu_threads}
+        if chunk_s:
+            result = _transcribe_chunked(audio, model_size, forced, engine, chunk_s, chunk_workers, **options)
+        else:
+            result = _run_engine(audio, model_size, forced, engine, **options)
+    text = result.get("text", "").strip()
+    whisper_lang = result.get("language", None)
+
+    with trace_stage(tracer, "langdetect"):
+        detected_lang, language_source = identify_language(
+            text, whisper_lang, result.get("language_probability"), force_language=forced)
 
+    if return_details:
+        return text, detected_lang, whisper_lang, {
+            "segments": _segments(result),
+            "language_source": language_source,
+            "language_probability": result.get("language_probability"),
+            "tiers": result.get("tiers"),
+        }
     return text, detected_lang, whisper_lang
@@ -0,0 +1,184 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def model_nbytes(model) -> int:
+    # HF pipelines wrap the torch module in .model; Whisper is the module itself
+    module = getattr(model, "model", model)
+    if not hasattr(module, "parameters"):
+        return 0
+    total = sum(p.numel() * p.element_size() for p in module.parameters())
+    if hasattr(module, "buffers"):
+        total += sum(b.numel() * b.element_size() for b in module.buffers())
+    return total
+
+def _free_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+class ModelCache:
+    # LRU cache keyed by (model, device, precision). With max_mb set, the least
+    # recently used models are unloaded once their estimated size exceeds it.
+    def __init__(self, max_mb: float = None):
+        self.max_bytes = int(max_mb * 2**20) if max_mb else None
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._loaders = {}
+        self._families = {}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def register(self, key: str, loader):
+        # loader(device, precision) -> model
+        self._loaders[key] = loader
+
+    def register_family(self, prefix: str, loader):
+        # e.g. "whisper" -> loader("small", device, precision) for key "whisper/small"
+        self._families[prefix] = loader
+
+    def _loader_for(self, key: str):
+        if key in self._loaders:
+            return self._loaders[key]
+        prefix, _, name = key.partition("/")
+        if prefix in self._families and name:
+            return lambda device, precision: self._families[prefix](name, device, precision)
+        raise KeyError(f"No loader registered for model '{key}'")
+
+    def _key_lock(self, cache_key):
+        with self._lock:
+            return self._locks.setdefault(cache_key, threading.Lock())
+
+    @staticmethod
+    def _label(cache_key) -> str:
+        key, device, precision = cache_key
+        return f"{key}@{device}/{precision}"
+
+    def get(self, key: str, device: str = "cpu", precision: str = "fp32"):
+        cache_key = (key, device, precision)
+        with self._lock:
+            if cache_key in self._models:
+                self.hits += 1
+                self._models.move_to_end(cache_key)
+                return self._models[cache_key]
+        # Per-key lock: two threads asking for the same model load it once,
+        # different models can still load concurrently
+        with self._key_lock(cache_key):
+            with self._lock:
+                if cache_key in self._models:
+                    self.hits += 1
+                    self._models.move_to_end(cache_key)
+                    return self._models[cache_key]
+                self.misses += 1
+            loader = self._loader_for(key)
+            label = self._label(cache_key)
+            print(f"[INFO] Loading model: {label} (this may take a moment)...")
+            rss_before = rss_bytes()
+            t0 = time.perf_counter()
+            model = loader(device, precision)
+            nbytes = model_nbytes(model)
+            rss_delta = max(0, rss_bytes() - rss_before)
+            self._stats[label] = {
+                "load_s": time.perf_counter() - t0,
+                "memory_mb": nbytes / 2**20,
+                "rss_delta_mb": rss_delta / 2**20,
+            }
+            print(f"[INFO] Model loaded: {label} ({self._stats[label]['load_s']:.1f}s)")
+            with self._lock:
+                self._models[cache_key] = model
+                self._sizes[cache_key] = nbytes or rss_delta
+                evicted = self._evict(keep=cache_key)
+            if evicted:
+                _free_memory()
+            return model
+
+    def _evict(self, keep):
+        # Caller holds self._lock
+        evicted = []
+        if self.max_bytes is None:
+            return evicted
+        while sum(self._sizes.values()) > self.max_bytes:
+            victim = next((k for k in self._models if k != keep), None)
+            if victim is None:
+                break
+            self._drop(victim)
+            self.evictions += 1
+            evicted.append(victim)
+            print(f"[INFO] Evicted model: {self._label(victim)}")
+        return evicted
+
+    def _drop(self, cache_key):
+        del self._models[cache_key]
+        del self._sizes[cache_key]
+        self._stats.pop(self._label(cache_key), None)
+
+    def unload(self, key: str, device: str = None, precision: str = None) -> int:
+        # Unloads every cached variant of key matching the given device/precision
+        with self._lock:
+            victims = [k for k in self._models
+                       if k[0] == key and device in (None, k[1]) and precision in (None, k[2])]
+            for k in victims:
+                self._drop(k)
+        if victims:
+            _free_memory()
+        return len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+            self._stats.clear()
+        _free_memory()
+
+    def __contains__(self, key: str) -> bool:
+        return any(k[0] == key for k in self._models)
+
+    def loaded(self):
+        return [self._label(k) for k in self._models]
+
+    def stats(self) -> dict:
+        return {label: dict(s) for label, s in self._stats.items()}
+
+    def counters(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "resident_mb": sum(self._sizes.values()) / 2**20,
+            "max_mb": self.max_bytes / 2**20 if self.max_bytes else None,
+        }
+
+    def warm_up(self, keys, background: bool = True):
+        # keys: "name" or ("name", device, precision)
+        def _run():
+            for key in keys:
+                args = (key,) if isinstance(key, str) else tuple(key)
+                try:
+                    self.get(*args)
+                except Exception as e:
+                    print(f"[WARN] Warm-up failed for {args[0]}: {e}")
+        if not background:
+            _run()
+            return None
+        thread = threading.Thread(target=_run, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+MODEL_CACHE = ModelCache(max_mb=float(os.environ["MODEL_CACHE_MAX_MB"]) if os.environ.get("MODEL_CACHE_MAX_MB") else None)
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+
+from jäljitys import Tracer
+
+STAGES = ("decode", "whisper", "audio_emotion", "text_emotion", "langdetect", "pipeline")
+
+_FILLER = ("I called about my order last week and nobody has gotten back to me yet. "
+           "Thanks for your help, that actually solves the problem. ")
+
+def synth_audio(duration_s: float, sample_rate: int, seed: int = 0) -> np.ndarray:
+    # Speech-like test signal: a harmonic voice with drifting pitch, ~4 Hz
+    # syllable envelope, short pauses and background noise. Offline and
+    # deterministic, so runs are comparable across machines and commits.
+    rng = np.random.default_rng(seed)
+    n = int(duration_s * sample_rate)
+    t = np.arange(n) / sample_rate
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.3 * t) + 10 * rng.standard_normal(n).cumsum() / np.sqrt(n)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 2
+    pauses = (np.sin(2 * np.pi * 0.2 * t) > -0.6).astype(np.float32)
+    signal = 0.2 * voice * syllables * pauses + 0.01 * rng.standard_normal(n)
+    return (signal / max(1e-9, np.abs(signal).max()) * 0.8).astype(np.float32)
+
+def write_wav(path: str, audio: np.ndarray, sample_rate: int):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+def _process_peak_rss_mb() -> float:
+    # Lifetime peak of the whole process, so it only ever grows across stages;
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+def _percentile(values, q):
+    return float(np.percentile(np.asarray(values), q))
+
+def _summarize(latencies, duration_s, spans=()):
+    # spans: one Tracer span per trial, sampled while that trial alone ran
+    mean = float(np.mean(latencies))
+    return {
+        "trials": len(latencies),
+        "p50_s": _percentile(latencies, 50),
+        "p95_s": _percentile(latencies, 95),
+        "mean_s": mean,
+        "rtf": mean / duration_s,
+        "files_per_s": 1.0 / mean if mean else float("inf"),
+        "stage_peak_rss_mb": max((s["rss_peak_mb"] for s in spans), default=0.0),
+        "stage_rss_delta_mb": max((s["rss_delta_mb"] for s in spans), default=0.0),
+        "process_peak_rss_mb": _process_peak_rss_mb(),
+    }
+
+def _stage_fns(path, model_size, text):
+    from ääni import load_audio
+    waveform = load_audio(path)
+
+    def decode():
+        load_audio(path)
+
+    def whisper():
+        from kuiskaus import transcribe_audio
+        transcribe_audio(waveform, model_size=model_size)
+
+    def audio_emotion():
+        from tunne import detect_audio_emotion
+        detect_audio_emotion(waveform)
+
+    def text_emotion():
+        from tunne import detect_text_emotion
+        detect_text_emotion(text)
+
+    def langdetect():
+        from langdetect import detect
+        detect(text)
+
+    def pipeline():
+        from analyysi import analyze
+        analyze(path, model_size=model_size, parallel=True)
+
+    return {"decode": decode, "whisper": whisper, "audio_emotion": audio_emotion,
+            "text_emotion": text_emotion, "langdetect": langdetect, "pipeline": pipeline}
+
+def run_benchmark(durations, sample_rates, stages=STAGES, trials: int = 5, warmup: int = 1,
+                  model_size: str = "small"):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for duration_s in durations:
+            # Roughly 2.5 words per second of audio
+            words = _FILLER.split()
+            n_words = max(1, int(duration_s * 2.5))
+            text = " ".join((words * (n_words // len(words) + 1))[:n_words])
+            for sample_rate in sample_rates:
+                path = os.path.join(tmp, f"synth_{duration_s:g}s_{sample_rate}.wav")
+                write_wav(path, synth_audio(duration_s, sample_rate), sample_rate)
+                fns = _stage_fns(path, model_size, text)
+                for stage in stages:
+                    for _ in range(warmup):
+                        fns[stage]()
+                    latencies, tracer = [], Tracer()
+                    for _ in range(trials):
+                        t0 = time.perf_counter()
+                        with tracer.stage(stage):
+                            fns[stage]()
+                        latencies.append(time.perf_counter() - t0)
+                    entry = {"stage": stage, "duration_s": duration_s, "sample_rate": sample_rate,
+                             **_summarize(latencies, duration_s, tracer.summary())}
+                    results.append(entry)
+                    print(f"[BENCH] {stage:<14} {duration_s:>6g}s @ {sample_rate:>5} Hz  "
+                          f"p50 {entry['p50_s']:.3f}s  p95 {entry['p95_s']:.3f}s  "
+                          f"RTF {entry['rtf']:.3f}  {entry['files_per_s']:.2f} files/s  "
+                          f"RSS {entry['stage_peak_rss_mb']:.0f} MB (+{entry['stage_rss_delta_mb']:.0f})")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "model_size": model_size,
+            "trials": trials,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+# Cold-start targets: each runs in a fresh interpreter under -X importtime
+IMPORT_TARGETS = {
+    "pipeline": ["pipeline.py", "--help"],
+    "ajo": ["-c", "import ajo"],
+    "analyysi": ["-c", "import analyysi"],
+    "kuiskaus": ["-c", "import kuiskaus"],
+    "tunne": ["-c", "import tunne"],
+}
+
+def _parse_importtime(stderr: str):
+    # "import time: self [us] | cumulative | imported package"; top-level
+    # imports have no indentation in the package column
+    total_us, modules = 0, []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line.split("|", 2)
+        if not package[1:].startswith(" "):
+            total_us += int(cumulative)
+            modules.append((package.strip(), int(cumulative) / 1e6))
+    modules.sort(key=lambda m: m[1], reverse=True)
+    return total_us / 1e6, modules
+
+def run_import_profile(targets=None, trials: int = 5):
+    # Wall time of a cold interpreter per entry point (p50/p95 over fresh
+    # processes) plus the heaviest top-level imports of the last run. Entries
+    # are shaped like run_benchmark() results so compare() works on them.
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for name in targets or IMPORT_TARGETS:
+        command = [sys.executable, "-X", "importtime", *IMPORT_TARGETS[name]]
+        latencies, proc = [], None
+        for _ in range(trials):
+            t0 = time.perf_counter()
+            proc = subprocess.run(command, cwd=root, capture_output=True, text=True)
+            latencies.append(time.perf_counter() - t0)
+        if proc.returncode != 0:
+            print(f"[IMPORT] {name}: failed ({proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode})")
+            continue
+        import_s, modules = _parse_importtime(proc.stderr)
+        entry = {"stage": f"import:{name}", "duration_s": 0, "sample_rate": 0, "trials": trials,
+                 "p50_s": _percentile(latencies, 50), "p95_s": _percentile(latencies, 95),
+                 "import_s": import_s, "heaviest": modules[:10]}
+        results.append(entry)
+        print(f"[IMPORT] {name:<16} p50 {entry['p50_s']:.3f}s  p95 {entry['p95_s']:.3f}s  imports {import_s:.3f}s")
+        for module, seconds in modules[:5]:
+            print(f"           {module:<30} {seconds:.3f}s")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "trials": trials,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = 0.10):
+    # Returns the entries whose p50 or p95 got slower than baseline by more than `threshold`
+    def _key(entry):
+        return (entry["stage"], entry["duration_s"], entry["sample_rate"])
+
+    base = {_key(e): e for e in baseline["results"]}
+    regressions = []
+    for entry in current["results"]:
+        ref = base.get(_key(entry))
+        if ref is None:
+            continue
+        for metric in ("p50_s", "p95_s"):
+            change = (entry[metric] - ref[metric]) / ref[metric] if ref[metric] else 0.0
+            status = "REGRESSION" if change > threshold else "ok"
+            print(f"[COMPARE] {entry['stage']:<14} {entry['duration_s']:>6g}s @ {entry['sample_rate']:>5} Hz  "
+                  f"{metric} {ref[metric]:.3f}s -> {entry[metric]:.3f}s ({change:+.1%}) {status}")
+            if change > threshold:
+                regressions.append({"key": _key(entry), "metric": metric, "change": change})
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage and end-to-end latency/throughput benchmark")
+    parser.add_argument("--durations", type=float, nargs="+", default=[5.0, 30.0, 120.0])
+    parser.add_argument("--sample_rates", type=int, nargs="+", default=[16000, 44100])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--model_size", type=str, default="small")
+    parser.add_argument("--output", type=str, default="bench_results.json")
+    parser.add_argument("--compare", type=str, default=None, help="baseline JSON from a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging")
+    parser.add_argument("--imports", nargs="*", choices=list(IMPORT_TARGETS), default=None,
+                        help="profile cold-start import time of the entry points instead (all if none given)")
+    args = parser.parse_args()
+
+    if args.imports is not None:
+        report = run_import_profile(args.imports, trials=args.trials)
+    else:
+        report = run_benchmark(args.durations, args.sample_rates, stages=args.stages, trials=args.trials,
+                               warmup=args.warmup, model_size=args.model_size)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"[COMPARE] {len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+        print("[COMPARE] No regressions")
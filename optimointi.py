@@ -0,0 +1,146 @@
+import argparse
+import os
+import re
+import shutil
+import tempfile
+
+# "fp32" is the stock PyTorch pipeline, "int8" applies dynamic quantization to
+# the Linear layers, "onnx" exports the model and runs it with ONNX Runtime
+BACKENDS = ("fp32", "int8", "onnx")
+
+ARTIFACT_DIR = os.environ.get(
+    "ASR_MODEL_ARTIFACTS", os.path.join(os.path.expanduser("~"), ".cache", "emotion-asr", "models"))
+
+_TASKS = {
+    "audio-classification": ("AutoModelForAudioClassification", "ORTModelForAudioClassification", "feature_extractor"),
+    "text-classification": ("AutoModelForSequenceClassification", "ORTModelForSequenceClassification", "tokenizer"),
+}
+
+def _artifact_path(model_name: str, backend: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name)
+    return os.path.join(ARTIFACT_DIR, f"{slug}-{backend}")
+
+def _preprocessor(task: str, model_name: str):
+    import transformers
+    if _TASKS[task][2] == "tokenizer":
+        return {"tokenizer": transformers.AutoTokenizer.from_pretrained(model_name)}
+    return {"feature_extractor": transformers.AutoFeatureExtractor.from_pretrained(model_name)}
+
+def _int8_model(task: str, model_name: str):
+    # Only the quantized weights are stored; the module is rebuilt from the
+    # config and quantized again on load, so nothing is unpickled. The packed
+    # int8 format follows torch, so the versions are part of the file name.
+    import torch
+    import transformers
+    model_cls = getattr(transformers, _TASKS[task][0])
+    versions = f"torch{torch.__version__}-transformers{transformers.__version__}"
+    path = _artifact_path(model_name, "int8") + f"-{re.sub(r'[^A-Za-z0-9_.-]+', '_', versions)}.pt"
+    if os.path.exists(path):
+        model = model_cls.from_config(transformers.AutoConfig.from_pretrained(model_name)).eval()
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.load_state_dict(torch.load(path, weights_only=True))
+        return model
+    print(f"[INFO] Quantizing {model_name} to int8 (cached in {path})")
+    model = model_cls.from_pretrained(model_name).eval()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    torch.save(model.state_dict(), tmp)
+    os.replace(tmp, path)
+    return model
+
+def _onnx_model(task: str, model_name: str):
+    try:
+        import optimum.onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError("The onnx backend requires optimum[onnxruntime] (pip install optimum[onnxruntime])") from e
+    model_cls = getattr(ort, _TASKS[task][1])
+    path = _artifact_path(model_name, "onnx")
+    if os.path.isdir(path):
+        return model_cls.from_pretrained(path)
+    print(f"[INFO] Exporting {model_name} to ONNX (cached in {path})")
+    model = model_cls.from_pretrained(model_name, export=True)
+    # Exported next to the target and renamed into place, so an interrupted
+    # export never leaves a partial directory behind under the final name
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", dir=os.path.dirname(path))
+    try:
+        model.save_pretrained(tmp)
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    return model
+
+def build_pipeline(task: str, model_name: str, backend: str = "fp32", device: str = "cpu", **kwargs):
+    from transformers import pipeline
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{backend}', expected one of {BACKENDS}")
+    if backend == "fp32":
+        return pipeline(task, model=model_name, device=device, **kwargs)
+    # Quantized and ONNX models are CPU-only
+    model = _int8_model(task, model_name) if backend == "int8" else _onnx_model(task, model_name)
+    return pipeline(task, model=model, **_preprocessor(task, model_name), **kwargs)
+
+def _distribution(predictions):
+    return dict(predictions)
+
+def compare_backends(backend: str, audios, transcripts):
+    # Runs the same samples through fp32 and `backend` and reports how far the
+    # scores move and how often the top-1 label changes
+    import tunne
+
+    def _run(name):
+        tunne.set_backend(name)
+        return tunne.detect_emotion_batch(audios, transcripts)
+
+    previous = tunne.get_backend()
+    try:
+        reference, candidate = _run("fp32"), _run(backend)
+    finally:
+        tunne.set_backend(previous)
+
+    report = {"backend": backend, "samples": len(reference)}
+    for name, idx in (("audio", 2), ("text", 5)):
+        deltas, agree = [], 0
+        for ref, cand in zip(reference, candidate):
+            ref_scores, cand_scores = _distribution(ref[idx]), _distribution(cand[idx])
+            deltas.extend(abs(sc - cand_scores.get(lbl, 0.0)) for lbl, sc in ref_scores.items())
+            agree += ref[idx][0][0] == cand[idx][0][0]
+        report[f"{name}_max_abs_delta"] = max(deltas) if deltas else 0.0
+        report[f"{name}_mean_abs_delta"] = sum(deltas) / len(deltas) if deltas else 0.0
+        report[f"{name}_top1_agreement"] = agree / max(len(reference), 1)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check an emotion backend against the fp32 models")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "fp32"], default="int8")
+    parser.add_argument("--samples", type=str, required=True, help="directory or manifest of audio files")
+    parser.add_argument("--limit", type=int, default=32)
+    parser.add_argument("--verify_batch", action="store_true",
+                        help="instead check detect_emotion_batch against per-item detect_emotion")
+    parser.add_argument("--window_s", type=float, default=None, help="--verify_batch: check the windowed path")
+    args = parser.parse_args()
+
+    from erä import iter_inputs
+    from kuiskaus import transcribe_audio
+    from ääni import load_audio
+
+    audios, transcripts = [], []
+    for path in iter_inputs(args.samples):
+        if len(audios) >= args.limit:
+            break
+        audio = load_audio(path)
+        audios.append(audio)
+        transcripts.append(transcribe_audio(audio)[0])
+
+    if args.verify_batch:
+        import tunne
+        delta = tunne.verify_batch(audios, transcripts, window_s=args.window_s)
+        print(f"[INFO] Batched vs single max_abs_delta: {delta:.2e}")
+        raise SystemExit(0)
+
+    report = compare_backends(args.backend, audios, transcripts)
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
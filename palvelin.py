@@ -0,0 +1,176 @@
+import json
+import queue
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ääni import load_audio
+
+class MicroBatcher:
+    # Collects concurrent requests into micro-batches: a batch closes when it
+    # holds max_batch items or max_wait_ms after its first item arrived.
+    # The queue is bounded; submit() raises queue.Full when it is saturated.
+    # Voice emotion only batches across requests with window_s set (see
+    # tunne.detect_emotion_batch); whole clips run one at a time.
+    def __init__(self, max_batch: int = 8, max_wait_ms: float = 50.0, max_queue: int = 32,
+                 window_s: float = None, hop_s: float = None):
+        self.max_batch = max_batch
+        self.window_s = window_s
+        self.hop_s = hop_s
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, audio_bytes, model_size="small", force_language=None) -> Future:
+        future = Future()
+        self.queue.put_nowait((audio_bytes, model_size, force_language, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # Requests with different ASR settings cannot share a Whisper call
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[1], item[2]), []).append(item)
+            for (model_size, force_language), items in groups.items():
+                self._run(items, model_size, force_language)
+
+    def _run(self, items, model_size, force_language):
+        from analyysi import result_dict
+        from kuiskaus import transcribe_audio
+        from tunne import detect_emotion_batch
+
+        audios, futures = [], []
+        for audio_bytes, _, _, future in items:
+            try:
+                audios.append(load_audio(audio_bytes))
+                futures.append(future)
+            except Exception as e:
+                future.set_exception(e)
+        if not audios:
+            return
+        try:
+            asr = [transcribe_audio(a, model_size=model_size, force_language=force_language) for a in audios]
+            emotions = detect_emotion_batch(audios, [t[0] for t in asr], batch_size=self.max_batch,
+                                            window_s=self.window_s, hop_s=self.hop_s)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, asr_result, emo in zip(futures, asr, emotions):
+            future.set_result(result_dict(asr_result, emo[:3], emo[3:]))
+
+def _handler(batcher, timeout_s):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                from mallit import MODEL_CACHE
+                from kuiskaus import tier_stats
+                self._send_json(200, {
+                    "status": "ok",
+                    "queued": batcher.queue.qsize(),
+                    "models": MODEL_CACHE.loaded(),
+                    "cache": MODEL_CACHE.counters(),
+                    "asr_tiers": tier_stats(),
+                })
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path != "/analyze":
+                self._send_json(404, {"error": "not found"})
+                return
+            params = urllib.parse.parse_qs(url.query)
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                self._send_json(400, {"error": "request body must contain the audio file"})
+                return
+            audio_bytes = self.rfile.read(length)
+            try:
+                future = batcher.submit(
+                    audio_bytes,
+                    model_size=params.get("model_size", ["small"])[0],
+                    force_language=params.get("force_language", [None])[0],
+                )
+            except queue.Full:
+                self.send_response(503)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            try:
+                self._send_json(200, future.result(timeout=timeout_s))
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+
+        def log_message(self, fmt, *args):
+            print(f"[SERVE] {self.address_string()} {fmt % args}")
+
+    return Handler
+
+def serve(host: str = "127.0.0.1", port: int = 8765, model_size: str = "small", max_batch: int = 8,
+          max_wait_ms: float = 50.0, max_queue: int = 32, timeout_s: float = 600.0, window_s: float = None,
+          hop_s: float = None):
+    from mallit import MODEL_CACHE
+    from kuiskaus import DEFAULT_ENGINE, preload
+    from tunne import audio_cache_key, text_cache_key
+
+    # Warm pool: every model is resident before the first request is accepted,
+    # the ASR model(s) for the configured engine exactly as requests load them
+    preload(model_size, engine=DEFAULT_ENGINE)
+    MODEL_CACHE.warm_up([audio_cache_key(), text_cache_key()], background=False)
+    batcher = MicroBatcher(max_batch=max_batch, max_wait_ms=max_wait_ms, max_queue=max_queue,
+                           window_s=window_s, hop_s=hop_s)
+    server = ThreadingHTTPServer((host, port), _handler(batcher, timeout_s))
+    print(f"[SERVE] Listening on http://{host}:{port} (POST /analyze, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def analyze_remote(url: str, audio_bytes, model_size: str = "small", force_language: str = None,
+                   timeout_s: float = 600.0) -> dict:
+    # Client for serve(): returns the same dict as analyysi.analyze
+    query = {"model_size": model_size}
+    if force_language:
+        query["force_language"] = force_language
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/analyze?{urllib.parse.urlencode(query)}",
+        data=bytes(audio_bytes),
+        headers={"Content-Type": "application/octet-stream"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout_s) as response:
+        result = json.loads(response.read().decode("utf-8"))
+    for field in ("audio_predictions", "text_predictions"):
+        result[field] = [tuple(p) for p in result[field]]
+    return result
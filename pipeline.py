@@ -2,39 +2,154 @@ import argparse,sys,os
 
 sys.path.append(os.path.dirname(__file__))
 
-from asr_whisper import transcribe_audio
-from emotion_model import detect_emotion
+# Model code (torch, whisper, transformers) and the recording stack are
+# imported by the modes that use them, so --help and the server client stay fast
 
-try:
-    from record_audio import record_audio_dynamic
-except ImportError:
-    record_audio_dynamic = None
-
-def run_pipeline(audio_file, model_size="small", force_lang=None, debug_emo=False):
+def run_pipeline(audio_file, model_size="small", force_lang=None, debug_emo=False,
+                 parallel=True, threads=None, cache=None,
+                 window_s=None, hop_s=None, segments=False, asr_options=None, vad=None, trace_out=None,
+                 store=None, fusion=None, emotion_head=None):
+    from analyysi import analyze
     print("\nRunning Emotion-Aware ASR")
-    transcript, detected_lang, whisper_lang = transcribe_audio(audio_file, model_size=model_size, force_language=force_lang)
+    tracer = None
+    if trace_out is not None:
+        from jäljitys import Tracer
+        tracer = Tracer()
+    # Decode once; ASR and audio emotion run concurrently on the same waveform
+    result = analyze(audio_file, model_size=model_size, force_language=force_lang, parallel=parallel,
+                     threads=threads, debug=debug_emo, cache=cache,
+                     window_s=window_s, hop_s=hop_s, segments=segments,
+                     asr_options=asr_options, vad=vad, tracer=tracer, fusion=fusion, emotion_head=emotion_head)
+    transcript = result["transcript"]
+    final_audio_label, final_text_label = result["audio_label"], result["text_label"]
+    if result.get("asr_tiers"):
+        tiers = result["asr_tiers"]
+        print(f"[ASR] Models: {' -> '.join(tiers['models'])} | "
+              f"{tiers['escalation_rate']:.0%} of the audio escalated")
+    if result.get("vad"):
+        print(f"[VAD] {len(result['vad']['speech_regions'])} speech regions, "
+              f"{result['vad']['skipped_fraction']:.0%} of the audio skipped")
     print(f"[ASR] Transcript: {transcript}")
-    print(f"[ASR] Detected language (text-based): {detected_lang} | Whisper: {whisper_lang}")
+    print(f"[ASR] Detected language: {result['detected_lang']} ({result.get('language_source', 'text')}) "
+          f"| Whisper: {result['whisper_lang']}")
 
-    final_audio_label, audio_score, audio_predictions, final_text_label, text_score, text_predictions = detect_emotion(audio_file, transcript, debug=debug_emo)
     print("\n[EMO] Audio Emotion:")
-    print(f"  {final_audio_label} ({audio_score:.2f})")
+    print(f"  {final_audio_label} ({result['audio_score']:.2f})")
 
     print("\n[EMO] Text Emotion:")
-    print(f"  {final_text_label} ({text_score:.2f})")
+    print(f"  {final_text_label} ({result['text_score']:.2f})")
+
+    if result.get("fused_label"):
+        print("\n[EMO] Fused Emotion:")
+        print(f"  {result['fused_label']} ({result['fused_score']:.2f})")
+
+    if result.get("audio_timeline"):
+        print("\n[EMO] Audio Emotion Timeline:")
+        for entry in result["audio_timeline"]:
+            print(f"  {entry['start']:7.1f}s - {entry['end']:7.1f}s  {entry['label']} ({entry['score']:.2f})")
+
+    if result.get("text_segments"):
+        print("\n[EMO] Text Emotion per Segment:")
+        for seg in result["text_segments"]:
+            print(f"  {seg['start']:7.1f}s - {seg['end']:7.1f}s  {seg['label']} ({seg['score']:.2f})  {seg['text']}")
 
     print("\nFinal Annotated Transcript:")
     print(f"{transcript} [{final_audio_label} / {final_text_label}]")
 
+    if store is not None:
+        store.append({"path": os.path.abspath(audio_file), "recorded_at": os.path.getmtime(audio_file), **result})
+        print(f"[STORE] Appended to {store.directory} ({len(store)} results)")
+
+    if tracer is not None:
+        print("\n[TRACE] Stage timings:")
+        for span in tracer.summary():
+            print(f"  {span['stage']:<14} wall {span['wall_s']:7.3f}s | cpu {span['cpu_s']:7.3f}s | "
+                  f"peak RSS {span['rss_peak_mb']:7.0f} MB")
+        if trace_out:
+            with open(trace_out, "a" if trace_out.endswith(".jsonl") else "w", encoding="utf-8") as f:
+                if trace_out.endswith(".jsonl"):
+                    tracer.to_jsonl(f, audio_file=str(audio_file))
+                else:
+                    f.write(tracer.to_prometheus())
+            print(f"[TRACE] Written to {trace_out}")
+    return result
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--mode", choices=["file", "record"], default="file")
+    parser.add_argument("--mode", choices=["file", "record", "batch", "live", "serve"], default="file")
     parser.add_argument("--audio_file", type=str, default=None)
+    parser.add_argument("--input", type=str, default=None, help="batch mode: directory or manifest of audio paths")
+    parser.add_argument("--output", type=str, default="results.jsonl", help="batch mode: .jsonl, .parquet or a .store result store directory")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--prefetch", type=int, default=8)
+    parser.add_argument("--checkpoint", type=str, default=None)
     parser.add_argument("--model_size", type=str, default="small")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="serve mode: bind address")
+    parser.add_argument("--port", type=int, default=8765, help="serve mode: port")
+    parser.add_argument("--max_batch", type=int, default=8, help="serve mode: largest micro-batch")
+    parser.add_argument("--max_wait_ms", type=float, default=50.0, help="serve mode: how long a batch waits to fill")
+    parser.add_argument("--max_queue", type=int, default=32, help="serve mode: queued requests before 503")
+    parser.add_argument("--step_s", type=float, default=2.0, help="live mode: seconds between updates")
     parser.add_argument("--force_lang", type=str, default=None)
     parser.add_argument("--debug_emo", action="store_true")
+    parser.add_argument("--sequential", action="store_true", help="run ASR and audio emotion one after another")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="total CPU threads for the parallel ASR and emotion models (default: all cores)")
+    parser.add_argument("--window_s", type=float, default=None, help="classify audio emotion in sliding windows of this length")
+    parser.add_argument("--hop_s", type=float, default=None, help="window hop (default: half the window)")
+    parser.add_argument("--engine", choices=["whisper", "ctranslate2"], default=None,
+                        help="ASR engine (default: $ASR_ENGINE or whisper)")
+    parser.add_argument("--beam_size", type=int, default=None)
+    parser.add_argument("--tier_min_logprob", type=float, default=None,
+                        help="tiered model_size (auto or e.g. base,small): escalate segments below this avg logprob")
+    parser.add_argument("--tier_max_no_speech", type=float, default=None,
+                        help="tiered model_size: escalate segments above this no-speech probability")
+    parser.add_argument("--chunk_s", type=float, default=None,
+                        help="split long recordings at quiet points about every N seconds and transcribe in parallel")
+    parser.add_argument("--chunk_workers", type=int, default=None,
+                        help="processes for --chunk_s (default: $ASR_CHUNK_WORKERS or a quarter of the cores)")
+    parser.add_argument("--vad_filter", action="store_true", help="ctranslate2 engine: skip non-speech with Silero VAD")
+    parser.add_argument("--cpu_threads", type=int, default=None, help="ctranslate2 engine: ASR CPU threads (default: two thirds of --threads)")
+    parser.add_argument("--vad", choices=["energy", "silero"], default=None,
+                        help="run the models on detected speech only")
+    parser.add_argument("--segments", action="store_true", help="classify text emotion per Whisper segment")
+    parser.add_argument("--emotion_backend", choices=["fp32", "int8", "onnx"], default=None,
+                        help="emotion model runtime (default: $EMOTION_BACKEND or fp32)")
+    parser.add_argument("--fusion", choices=["late", "whisper"], default=None,
+                        help="fuse audio and text emotion; 'whisper' classifies voice emotion from Whisper "
+                             "encoder embeddings instead of running wav2vec2")
+    parser.add_argument("--emotion_head", type=str, default=None,
+                        help="fusion=whisper: .npz head from fuusio.py (default: $EMOTION_HEAD)")
+    parser.add_argument("--trace", action="store_true", help="print per-stage wall/CPU time and peak memory")
+    parser.add_argument("--trace_out", type=str, default=None,
+                        help="also write the trace: .jsonl appends JSON lines, anything else is Prometheus text")
+    parser.add_argument("--store", type=str, default=None,
+                        help="append results to a columnar result store directory (see tulokset.py)")
+    parser.add_argument("--no_cache", action="store_true", help="do not read or write the result cache")
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--cache_mb", type=float, default=None)
     args = parser.parse_args()
 
+    if args.emotion_backend:
+        from tunne import set_backend
+        set_backend(args.emotion_backend)
+
+    asr_options = {"engine": args.engine, "beam_size": args.beam_size,
+                   "vad_filter": args.vad_filter, "cpu_threads": args.cpu_threads,
+                   "tier_min_logprob": args.tier_min_logprob, "tier_max_no_speech": args.tier_max_no_speech,
+                   "chunk_s": args.chunk_s, "chunk_workers": args.chunk_workers}
+    asr_options = {k: v for k, v in asr_options.items() if v is not None and v is not False}
+
+    cache = None
+    if not args.no_cache and args.mode != "batch":
+        from välimuisti import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, ResultCache
+        cache = ResultCache(args.cache_dir or DEFAULT_CACHE_DIR, args.cache_mb or DEFAULT_MAX_MB)
+
+    store = None
+    if args.store:
+        from tulokset import ResultStore
+        store = ResultStore(args.store)
+
     if args.mode == "file":
         if not args.audio_file:
             print("Provide --audio_file when using mode=file")
@@ -44,10 +159,59 @@ if __name__ == "__main__":
             model_size=args.model_size,
             force_lang=args.force_lang,
             debug_emo=args.debug_emo,
+            parallel=not args.sequential,
+            threads=args.threads,
+            cache=cache,
+            window_s=args.window_s,
+            hop_s=args.hop_s,
+            segments=args.segments,
+            asr_options=asr_options,
+            vad=args.vad,
+            trace_out=args.trace_out or ("" if args.trace else None),
+            store=store,
+            fusion=args.fusion,
+            emotion_head=args.emotion_head,
+        )
+    elif args.mode == "batch":
+        if not args.input:
+            print("Provide --input (directory or manifest) when using mode=batch")
+            sys.exit(1)
+        from erä import run_batch
+        run_batch(
+            args.input,
+            args.output,
+            model_size=args.model_size,
+            force_language=args.force_lang,
+            workers=args.workers,
+            prefetch=args.prefetch,
+            checkpoint=args.checkpoint,
+            asr_options=asr_options,
+            vad=args.vad,
+        )
+    elif args.mode == "serve":
+        from palvelin import serve
+        serve(
+            host=args.host,
+            port=args.port,
+            model_size=args.model_size,
+            max_batch=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+            max_queue=args.max_queue,
+            window_s=args.window_s,
+            hop_s=args.hop_s,
         )
+    elif args.mode == "live":
+        try:
+            from äänitys import stream_live
+        except ImportError:
+            print("Live mode not available (missing äänitys.py or sounddevice)")
+            sys.exit(1)
+        stream_live(model_size=args.model_size, step_s=args.step_s)
     else:
-        if record_audio_dynamic is None:
-            print("Recording not available (missing record_audio.py)")
+        try:
+            from äänitys import record_audio_dynamic
+        except ImportError:
+            print("Recording not available (missing äänitys.py)")
             sys.exit(1)
         audio_file = record_audio_dynamic()
         run_pipeline(
@@ -55,4 +219,16 @@ if __name__ == "__main__":
             model_size=args.model_size,
             force_lang=args.force_lang,
             debug_emo=args.debug_emo,
+            parallel=not args.sequential,
+            threads=args.threads,
+            cache=cache,
+            window_s=args.window_s,
+            hop_s=args.hop_s,
+            segments=args.segments,
+            asr_options=asr_options,
+            vad=args.vad,
+            trace_out=args.trace_out or ("" if args.trace else None),
+            store=store,
+            fusion=args.fusion,
+            emotion_head=args.emotion_head,
         )
@@ -0,0 +1,138 @@
+import threading
+
+import numpy as np
+
+from mallit import MODEL_CACHE
+from ääni import SAMPLE_RATE
+
+def _runs(mask):
+    # (start, end) index pairs of the True runs in a boolean array
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges.reshape(-1, 2)
+
+def energy_regions(audio: np.ndarray, frame_ms: int = 30, margin_db: float = 12.0, floor_db: float = -50.0,
+                   min_speech_ms: int = 250, min_silence_ms: int = 400):
+    # Frame energy against an adaptive threshold: the quietest 10% of frames
+    # estimate the noise floor, speech has to clear it by margin_db
+    frame = int(SAMPLE_RATE * frame_ms / 1000)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+    frames = audio[: n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    threshold = max(floor_db, float(np.percentile(energy_db, 10)) + margin_db)
+    speech = energy_db > threshold
+
+    # Bridge short pauses inside speech, then drop blips that are too short
+    for start, end in _runs(~speech):
+        if 0 < start and end < n_frames and (end - start) * frame_ms < min_silence_ms:
+            speech[start:end] = True
+    for start, end in _runs(speech):
+        if (end - start) * frame_ms < min_speech_ms:
+            speech[start:end] = False
+
+    regions = [(int(s) * frame, int(e) * frame) for s, e in _runs(speech)]
+    if regions and regions[-1][1] == n_frames * frame:
+        regions[-1] = (regions[-1][0], len(audio))
+    return regions
+
+# Pinned release of the hub repo, so first use never pulls unreviewed code
+SILERO_REPO = "snakers4/silero-vad:v5.1.2"
+
+class _Silero:
+    # The hub model keeps recurrent state between calls, so one file at a time
+    def __init__(self, model, get_speech_timestamps):
+        self.model = model
+        self.get_speech_timestamps = get_speech_timestamps
+        self.lock = threading.Lock()
+
+def _load_silero(device, precision):
+    import torch
+    model, utils = torch.hub.load(SILERO_REPO, "silero_vad", trust_repo=True)
+    return _Silero(model, utils[0])
+
+MODEL_CACHE.register("vad/silero", _load_silero)
+
+def silero_regions(audio: np.ndarray):
+    # Model-based VAD; better than energy at telling speech from hold music
+    import torch
+    silero = MODEL_CACHE.get("vad/silero")
+    with silero.lock:
+        stamps = silero.get_speech_timestamps(torch.from_numpy(audio), silero.model, sampling_rate=SAMPLE_RATE)
+    return [(int(t["start"]), int(t["end"])) for t in stamps]
+
+def quietest_point(audio: np.ndarray, start: int, end: int, frame_ms: int = 30, smooth_frames: int = 5) -> int:
+    # Sample index of the quietest stretch in audio[start:end], a safe place
+    # to cut between words; energy is smoothed over ~150 ms so a single quiet
+    # frame inside a word does not win
+    frame = int(SAMPLE_RATE * frame_ms / 1000)
+    n_frames = (end - start) // frame
+    if n_frames == 0:
+        return (start + end) // 2
+    frames = audio[start: start + n_frames * frame].reshape(n_frames, frame)
+    energy = np.mean(frames * frames, axis=1)
+    if n_frames > smooth_frames:
+        energy = np.convolve(energy, np.ones(smooth_frames) / smooth_frames, mode="same")
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+def silence_boundaries(audio: np.ndarray, every_s: float, search_s: float = 10.0):
+    # Cut points roughly every_s apart, each moved to the quietest point
+    # within +-search_s of its target; returns [0, ..., len(audio)]
+    every, search = int(every_s * SAMPLE_RATE), int(search_s * SAMPLE_RATE)
+    bounds = [0]
+    target = every
+    while target < len(audio) - every // 2:
+        lo, hi = max(bounds[-1] + 1, target - search), min(len(audio), target + search)
+        bounds.append(quietest_point(audio, lo, hi))
+        target = bounds[-1] + every
+    bounds.append(len(audio))
+    return bounds
+
+VAD_METHODS = {
+    "energy": energy_regions,
+    "silero": silero_regions,
+}
+
+class SpeechMap:
+    # Speech regions of one waveform, and the mapping between the compacted
+    # (speech-only) timeline the models see and the original recording
+    def __init__(self, regions, n_samples: int, pad_ms: int = 150):
+        pad = int(SAMPLE_RATE * pad_ms / 1000)
+        merged = []
+        for start, end in regions:
+            start, end = max(0, start - pad), min(n_samples, end + pad)
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.regions = merged
+        self.n_samples = n_samples
+        lengths = np.array([e - s for s, e in merged], dtype=np.int64)
+        self._compact_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(merged) else np.zeros(0, np.int64)
+        self.speech_samples = int(lengths.sum())
+
+    @property
+    def skipped_fraction(self) -> float:
+        return 1.0 - self.speech_samples / self.n_samples if self.n_samples else 0.0
+
+    def speech_audio(self, audio: np.ndarray) -> np.ndarray:
+        if len(self.regions) == 1 and self.regions[0] == (0, self.n_samples):
+            return audio
+        return np.concatenate([audio[s:e] for s, e in self.regions]) if self.regions else audio[:0]
+
+    def to_original(self, t: float) -> float:
+        # Seconds on the compacted timeline -> seconds in the original recording
+        if not self.regions:
+            return t
+        sample = t * SAMPLE_RATE
+        i = max(0, int(np.searchsorted(self._compact_starts, sample, side="right")) - 1)
+        return (self.regions[i][0] + sample - self._compact_starts[i]) / SAMPLE_RATE
+
+    def regions_s(self):
+        return [(s / SAMPLE_RATE, e / SAMPLE_RATE) for s, e in self.regions]
+
+def detect_speech(audio: np.ndarray, method: str = "energy", pad_ms: int = 150) -> SpeechMap:
+    if method not in VAD_METHODS:
+        raise ValueError(f"Unknown VAD method '{method}', expected one of {sorted(VAD_METHODS)}")
+    return SpeechMap(VAD_METHODS[method](audio), len(audio), pad_ms=pad_ms)
@@ -0,0 +1,288 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from tunne import AUDIO_LABELS, TEXT_LABELS, score_vector
+
+DEFAULT_STORE_DIR = os.environ.get(
+    "ASR_RESULTS_STORE", os.path.join(os.path.expanduser("~"), ".cache", "emotion-asr", "store"))
+
+# One raw little-endian file per column, one fixed-width record per result.
+# Strings and timelines are variable length: their bytes/windows live in
+# separate files and the per-row column holds the running end offset.
+# analyzed_at is when the result was produced; recorded_at is when the audio
+# was recorded (file mtime), NaN when unknown, e.g. for browser uploads.
+ROW_COLUMNS = {
+    "analyzed_at": ("<f8", 1),
+    "recorded_at": ("<f8", 1),
+    "duration_s": ("<f4", 1),
+    "detected_lang": ("<u2", 1),
+    "whisper_lang": ("<u2", 1),
+    "audio_label": ("u1", 1),
+    "audio_score": ("<f4", 1),
+    "audio_probs": ("<f4", len(AUDIO_LABELS)),
+    "text_label": ("u1", 1),
+    "text_score": ("<f4", 1),
+    "text_probs": ("<f4", len(TEXT_LABELS)),
+    "transcript_end": ("<i8", 1),
+    "path_end": ("<i8", 1),
+    "timeline_end": ("<i8", 1),
+}
+WINDOW_COLUMNS = {
+    "window_start": ("<f4", 1),
+    "window_end": ("<f4", 1),
+    "window_probs": ("<f4", len(AUDIO_LABELS)),
+}
+BLOBS = ("transcript", "path")
+# analyzed_at is written last and defines the row count, so a reader never
+# sees a half-appended row
+_WRITE_ORDER = [name for name in ROW_COLUMNS if name != "analyzed_at"] + ["analyzed_at"]
+_VERSION = 2
+TIME_FIELDS = ("recorded_at", "analyzed_at")
+
+class ResultStore:
+    # Append-only columnar store for analyze() results. Reads go through
+    # np.memmap, so queries over months of calls only page in the columns they
+    # touch. One writer at a time; any number of readers.
+    def __init__(self, directory: str = DEFAULT_STORE_DIR, flush_rows: int = 256):
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self._pending = []
+        self._lock = threading.Lock()
+        self._repaired = False
+        os.makedirs(directory, exist_ok=True)
+        self._schema_path = os.path.join(directory, "schema.json")
+        if not os.path.exists(self._schema_path):
+            self._save_schema({
+                "version": _VERSION,
+                "rows": {name: list(spec) for name, spec in ROW_COLUMNS.items()},
+                "windows": {name: list(spec) for name, spec in WINDOW_COLUMNS.items()},
+                "blobs": list(BLOBS),
+                "categories": {"lang": [""], "audio_label": list(AUDIO_LABELS), "text_label": list(TEXT_LABELS)},
+            })
+        self.schema = self._load_schema()
+        if self.schema.get("version") != _VERSION:
+            raise RuntimeError(f"Unsupported result store version {self.schema.get('version')} in {directory}")
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def _load_schema(self):
+        with open(self._schema_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_schema(self, schema):
+        tmp = f"{self._schema_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=2)
+        os.replace(tmp, self._schema_path)
+
+    # ----- writing -----
+
+    def _code(self, category: str, value) -> int:
+        values = self.schema["categories"][category]
+        value = value or ""
+        if value not in values:
+            values.append(value)
+            self._save_schema(self.schema)
+        return values.index(value)
+
+    def _repair(self):
+        # An interrupted append can leave columns longer than the committed
+        # row count; cut them back so the next append lines up again
+        rows = len(self)
+        for name, (dtype, width) in ROW_COLUMNS.items():
+            self._truncate(name, rows * width * np.dtype(dtype).itemsize)
+        ends = {name: int(self.column(f"{name}_end")[-1]) if rows else 0 for name in BLOBS + ("timeline",)}
+        for name in BLOBS:
+            self._truncate(name, ends[name])
+        for name, (dtype, width) in WINDOW_COLUMNS.items():
+            self._truncate(name, ends["timeline"] * width * np.dtype(dtype).itemsize)
+        self._repaired = True
+
+    def _truncate(self, name: str, size: int):
+        path = self._file(name)
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    # write(), flush() and close() return the results that reached the column
+    # files, so batch checkpoints never get ahead of the store (see erä.py)
+    def write(self, result: dict):
+        with self._lock:
+            self._pending.append(result)
+            if len(self._pending) >= self.flush_rows:
+                return self._flush()
+        return []
+
+    def append(self, result: dict):
+        # Single result, visible to readers immediately
+        self.write(result)
+        return self.flush()
+
+    def flush(self):
+        with self._lock:
+            return self._flush()
+
+    def close(self):
+        return self.flush()
+
+    def _flush(self):
+        if not self._pending:
+            return []
+        if not self._repaired:
+            self._repair()
+        rows = len(self)
+        ends = {name: int(self.column(f"{name}_end")[-1]) if rows else 0 for name in BLOBS + ("timeline",)}
+
+        columns = {name: [] for name in ROW_COLUMNS}
+        windows = {name: [] for name in WINDOW_COLUMNS}
+        blobs = {name: [] for name in BLOBS}
+        for result in self._pending:
+            audio_probs = score_vector(result.get("audio_predictions"), AUDIO_LABELS)
+            text_probs = score_vector(result.get("text_predictions"), TEXT_LABELS)
+            columns["analyzed_at"].append(result.get("analyzed_at") or time.time())
+            recorded_at = result.get("recorded_at")
+            columns["recorded_at"].append(np.nan if recorded_at is None else recorded_at)
+            columns["duration_s"].append(result.get("duration_s") or 0.0)
+            columns["detected_lang"].append(self._code("lang", result.get("detected_lang")))
+            columns["whisper_lang"].append(self._code("lang", result.get("whisper_lang")))
+            columns["audio_label"].append(int(audio_probs.argmax()))
+            columns["audio_score"].append(result.get("audio_score") or 0.0)
+            columns["audio_probs"].append(audio_probs)
+            columns["text_label"].append(int(text_probs.argmax()))
+            columns["text_score"].append(result.get("text_score") or 0.0)
+            columns["text_probs"].append(text_probs)
+            for name in BLOBS:
+                data = (result.get(name) or "").encode("utf-8")
+                blobs[name].append(data)
+                ends[name] += len(data)
+                columns[f"{name}_end"].append(ends[name])
+            for entry in result.get("audio_timeline") or []:
+                windows["window_start"].append(entry["start"])
+                windows["window_end"].append(entry["end"])
+                windows["window_probs"].append(score_vector(entry["predictions"], AUDIO_LABELS))
+                ends["timeline"] += 1
+            columns["timeline_end"].append(ends["timeline"])
+
+        for name in BLOBS:
+            with open(self._file(name), "ab") as f:
+                f.write(b"".join(blobs[name]))
+        for name, (dtype, _) in WINDOW_COLUMNS.items():
+            if windows[name]:
+                with open(self._file(name), "ab") as f:
+                    f.write(np.asarray(windows[name], dtype=dtype).tobytes())
+        for name in _WRITE_ORDER:
+            with open(self._file(name), "ab") as f:
+                f.write(np.asarray(columns[name], dtype=ROW_COLUMNS[name][0]).tobytes())
+        written, self._pending = self._pending, []
+        return written
+
+    # ----- reading -----
+
+    def __len__(self) -> int:
+        path = self._file("analyzed_at")
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+    def column(self, name: str, rows: int = None) -> np.ndarray:
+        # Read-only memory map of a row or window column, (n,) or (n, width)
+        if name in ROW_COLUMNS:
+            dtype, width = ROW_COLUMNS[name]
+            n = len(self) if rows is None else rows
+        else:
+            dtype, width = WINDOW_COLUMNS[name]
+            committed = len(self)
+            n = int(self.column("timeline_end", committed)[-1]) if committed else 0
+        shape = (n, width) if width > 1 else (n,)
+        if n == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    def categories(self, name: str):
+        return list(self._load_schema()["categories"][name])
+
+    def _span(self, name: str, i: int):
+        ends = self.column(f"{name}_end")
+        return (int(ends[i - 1]) if i else 0), int(ends[i])
+
+    def text(self, name: str, i: int) -> str:
+        start, end = self._span(name, i)
+        with open(self._file(name), "rb") as f:
+            f.seek(start)
+            return f.read(end - start).decode("utf-8")
+
+    def transcript(self, i: int) -> str:
+        return self.text("transcript", i)
+
+    def timeline(self, i: int):
+        # (starts, ends, probs) of row i's audio emotion windows
+        start, end = self._span("timeline", i)
+        return tuple(self.column(name)[start:end] for name in WINDOW_COLUMNS)
+
+    def emotion_distribution(self, by: str = "day", source: str = "audio", since: float = None,
+                             until: float = None, language: str = None, time_field: str = "recorded_at",
+                             chunk_rows: int = 1 << 20):
+        # Mean probability per emotion and top-label counts, grouped by UTC day
+        # or by detected language. Days and since/until refer to time_field;
+        # rows without a recording time are left out when filtering or
+        # grouping by recorded_at. Rows are scanned in chunks so only
+        # chunk_rows x width floats are resident at a time.
+        if time_field not in TIME_FIELDS:
+            raise ValueError(f"Unknown time field '{time_field}', expected one of {TIME_FIELDS}")
+        if by not in ("day", "lang"):
+            raise ValueError(f"Unknown grouping '{by}', expected 'day' or 'lang'")
+        if source not in ("audio", "text"):
+            raise ValueError(f"Unknown source '{source}', expected 'audio' or 'text'")
+        labels = AUDIO_LABELS if source == "audio" else TEXT_LABELS
+        langs = self.categories("lang")
+        lang_code = langs.index(language) if language in langs else None
+        if language is not None and lang_code is None:
+            return {"keys": [], "labels": labels, "mean": np.zeros((0, len(labels)), np.float32),
+                    "top": np.zeros((0, len(labels)), np.int64), "count": np.zeros(0, np.int64)}
+
+        rows = len(self)
+        timestamps = self.column(time_field, rows)
+        lang_col = self.column("detected_lang", rows)
+        probs = self.column(f"{source}_probs", rows)
+        top = self.column(f"{source}_label", rows)
+        sums, tops, counts = {}, {}, {}
+        for lo in range(0, rows, chunk_rows):
+            hi = min(rows, lo + chunk_rows)
+            ts = np.asarray(timestamps[lo:hi])
+            mask = np.ones(hi - lo, dtype=bool)
+            if by == "day" or since is not None or until is not None:
+                mask &= ~np.isnan(ts)
+            if since is not None:
+                mask &= ts >= since
+            if until is not None:
+                mask &= ts < until
+            lang = np.asarray(lang_col[lo:hi])
+            if lang_code is not None:
+                mask &= lang == lang_code
+            if not mask.any():
+                continue
+            group = (ts[mask] // 86400).astype(np.int64) if by == "day" else lang[mask].astype(np.int64)
+            keys, inverse = np.unique(group, return_inverse=True)
+            chunk_sums = np.zeros((len(keys), len(labels)), dtype=np.float64)
+            np.add.at(chunk_sums, inverse, np.asarray(probs[lo:hi])[mask])
+            chunk_tops = np.zeros((len(keys), len(labels)), dtype=np.int64)
+            np.add.at(chunk_tops, (inverse, np.asarray(top[lo:hi])[mask]), 1)
+            chunk_counts = np.bincount(inverse, minlength=len(keys))
+            for k, key in enumerate(keys.tolist()):
+                sums[key] = sums.get(key, 0) + chunk_sums[k]
+                tops[key] = tops.get(key, 0) + chunk_tops[k]
+                counts[key] = counts.get(key, 0) + int(chunk_counts[k])
+
+        keys = sorted(counts)
+        count = np.array([counts[k] for k in keys], dtype=np.int64)
+        mean = (np.array([sums[k] for k in keys]) / count[:, None]).astype(np.float32) if keys else \
+            np.zeros((0, len(labels)), np.float32)
+        return {
+            "keys": [np.datetime64(k, "D") for k in keys] if by == "day" else [langs[k] or "unknown" for k in keys],
+            "labels": labels,
+            "mean": mean,
+            "top": np.array([tops[k] for k in keys], dtype=np.int64).reshape(len(keys), len(labels)),
+            "count": count,
+        }
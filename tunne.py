@@ -1,16 +1,46 @@
-from transformers import pipeline
+import os
+import numpy as np
+from ääni import SAMPLE_RATE, as_pipeline_input, iter_windows, load_audio
+from mallit import MODEL_CACHE
+from optimointi import BACKENDS, build_pipeline
 
 # Audio model
 AUDIO_MODEL_NAME = "superb/wav2vec2-base-superb-er"
-print(f"[INFO] Loading audio emotion model: {AUDIO_MODEL_NAME}")
-audio_classifier = pipeline("audio-classification", model=AUDIO_MODEL_NAME)
-print("[INFO] Audio emotion model loaded")
-
 # Text model
 TEXT_MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
-print(f"[INFO] Loading text emotion model: {TEXT_MODEL_NAME}")
-text_classifier = pipeline("text-classification", model=TEXT_MODEL_NAME, return_all_scores=True)
-print("[INFO] Text emotion model loaded")
+
+# Inference backend: fp32 (PyTorch), int8 (dynamic quantization) or onnx (ONNX Runtime).
+# The backend is the precision part of the cache key, so switching keeps both resident.
+_BACKEND = os.environ.get("EMOTION_BACKEND", "fp32")
+
+def set_backend(backend: str):
+    global _BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{backend}', expected one of {BACKENDS}")
+    _BACKEND = backend
+    # Worker processes started later pick it up from the environment
+    os.environ["EMOTION_BACKEND"] = backend
+
+def get_backend() -> str:
+    return _BACKEND
+
+# Pipelines are built on first use, not at import
+MODEL_CACHE.register("emotion/audio", lambda device, precision: build_pipeline(
+    "audio-classification", AUDIO_MODEL_NAME, backend=precision, device=device))
+MODEL_CACHE.register("emotion/text", lambda device, precision: build_pipeline(
+    "text-classification", TEXT_MODEL_NAME, backend=precision, device=device, return_all_scores=True))
+
+def audio_cache_key():
+    return ("emotion/audio", "cpu", _BACKEND)
+
+def text_cache_key():
+    return ("emotion/text", "cpu", _BACKEND)
+
+def get_audio_classifier():
+    return MODEL_CACHE.get(*audio_cache_key())
+
+def get_text_classifier():
+    return MODEL_CACHE.get(*text_cache_key())
 
 # Map audio labels to full names
 audio_label_map = {
@@ -20,6 +50,20 @@ audio_label_map = {
     "sad": "sad",
 }
 
+# Fixed label orders, for dense score vectors
+AUDIO_LABELS = tuple(audio_label_map.values())
+TEXT_LABELS = ("anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise")
+
+def score_vector(predictions, labels):
+    # [(label, score)] or [{"label", "score"}] -> dense float32 vector in `labels` order
+    out = np.zeros(len(labels), dtype=np.float32)
+    index = {lbl: i for i, lbl in enumerate(labels)}
+    for p in predictions or []:
+        lbl, score = (p["label"], p["score"]) if isinstance(p, dict) else p
+        if lbl in index:
+            out[index[lbl]] = score
+    return out
+
 def _intensity_label(base_label: str, score: float) -> str:
     if score >= 0.85:
         return f"strongly {base_label}"
@@ -28,23 +72,24 @@ def _intensity_label(base_label: str, score: float) -> str:
     else:
         return f"slightly {base_label}"
 
-def detect_emotion(audio_path: str, transcript: str, debug: bool = False):
-    # Audio prediction
-    audio_results = audio_classifier(audio_path, top_k=3)
-    audio_predictions = []
-    for r in audio_results:
-        lbl = audio_label_map.get(r["label"], r["label"])
-        audio_predictions.append((lbl, float(r["score"])))
-    audio_predictions.sort(key=lambda x: x[1], reverse=True)
+def _audio_label(audio_predictions):
     top_audio_label, top_audio_score = audio_predictions[0]
     if len(audio_predictions) > 1 and abs(audio_predictions[0][1] - audio_predictions[1][1]) < 0.15:
         final_audio_label = f"uncertain ({audio_predictions[0][0]}/{audio_predictions[1][0]})"
     else:
         final_audio_label = _intensity_label(top_audio_label, top_audio_score)
+    return final_audio_label, top_audio_score
+
+def _audio_emotion(audio_results):
+    audio_predictions = []
+    for r in audio_results:
+        lbl = audio_label_map.get(r["label"], r["label"])
+        audio_predictions.append((lbl, float(r["score"])))
+    audio_predictions.sort(key=lambda x: x[1], reverse=True)
+    final_audio_label, top_audio_score = _audio_label(audio_predictions)
+    return final_audio_label, top_audio_score, audio_predictions
 
-    # Text prediction
-    text_results = text_classifier(transcript)
-    all_scores = text_results[0]
+def _text_emotion(all_scores):
     text_predictions = []
     for entry in all_scores:
         lbl = entry["label"]
@@ -52,13 +97,214 @@ def detect_emotion(audio_path: str, transcript: str, debug: bool = False):
         text_predictions.append((lbl, float(score)))
     text_predictions.sort(key=lambda x: x[1], reverse=True)
     top_text_label, top_text_score = text_predictions[0]
+    return top_text_label, top_text_score, text_predictions
+
+def detect_audio_emotion(audio):
+    # Audio prediction (path or 16 kHz float32 waveform)
+    # All labels, so the stored/fused distributions have no artificial zeros
+    return _audio_emotion(get_audio_classifier()(as_pipeline_input(audio), top_k=len(audio_label_map)))
+
+# Same tokenizer options on every text path, so batched and single scores match
+_TEXT_KWARGS = {"truncation": True}
+
+def _equal_length_batches(items, batch_size):
+    # The audio model runs without an attention mask, so zero padding in a
+    # mixed-length batch would change its scores; batch equal lengths only
+    buckets = {}
+    for i, item in enumerate(items):
+        buckets.setdefault(len(item), []).append(i)
+    for indices in buckets.values():
+        for k in range(0, len(indices), batch_size):
+            yield indices[k:k + batch_size]
+
+def _timeline_entry(start, n_samples, audio_results):
+    final_label, score, predictions = _audio_emotion(audio_results)
+    return {
+        "start": start / SAMPLE_RATE,
+        "end": (start + n_samples) / SAMPLE_RATE,
+        "label": final_label,
+        "score": score,
+        "predictions": predictions,
+    }
+
+def audio_emotion_timeline(audio, window_s: float = 10.0, hop_s: float = 5.0, batch_size: int = 8):
+    # Per-window labels over the recording (waveform or file path, which is
+    # decoded incrementally); windows are classified in small batches
+    # straight from the generator, so memory stays bounded
+    window, hop = int(window_s * SAMPLE_RATE), int(hop_s * SAMPLE_RATE)
+    classifier = get_audio_classifier()
+    timeline = []
+
+    def _flush(pending):
+        results = classifier([as_pipeline_input(w) for _, w in pending],
+                             top_k=len(audio_label_map), batch_size=batch_size)
+        for (start, w), res in zip(pending, results):
+            timeline.append(_timeline_entry(start, len(w), res))
+
+    pending = []
+    for start, w in iter_windows(audio, window, hop):
+        # The shorter last window goes in a batch of its own (no padding)
+        if pending and len(w) != len(pending[0][1]):
+            _flush(pending)
+            pending = []
+        pending.append((start, w))
+        if len(pending) == batch_size:
+            _flush(pending)
+            pending = []
+    if pending:
+        _flush(pending)
+    return timeline
+
+def summarize_timeline(timeline):
+    # Duration-weighted mean of the per-window distributions
+    totals, weight = {}, 0.0
+    for entry in timeline:
+        w = entry["end"] - entry["start"]
+        weight += w
+        for lbl, sc in entry["predictions"]:
+            totals[lbl] = totals.get(lbl, 0.0) + w * sc
+    audio_predictions = sorted(((lbl, sc / weight) for lbl, sc in totals.items()),
+                               key=lambda x: x[1], reverse=True)
+    final_audio_label, top_audio_score = _audio_label(audio_predictions)
+    return final_audio_label, top_audio_score, audio_predictions
+
+def detect_audio_emotion_windowed(audio, window_s: float = 10.0, hop_s: float = 5.0, batch_size: int = 8):
+    timeline = audio_emotion_timeline(audio, window_s, hop_s, batch_size)
+    return (*summarize_timeline(timeline), timeline)
+
+def detect_text_emotion(transcript: str):
+    return _text_emotion(get_text_classifier()(transcript, **_TEXT_KWARGS)[0])
+
+def detect_text_emotion_segments(segments, batch_size: int = 16):
+    # Classifies each Whisper segment (well under the 512-token limit) in
+    # batches and aggregates by text length, so long transcripts are covered
+    # in full instead of being truncated
+    segments = [seg for seg in segments if seg["text"].strip()]
+    if not segments:
+        return (*detect_text_emotion(""), [])
+
+    texts = [seg["text"] for seg in segments]
+    order = _by_length(texts)
+    results = get_text_classifier()([texts[i] for i in order], batch_size=batch_size, **_TEXT_KWARGS)
+    per_segment = [None] * len(segments)
+    for i, res in zip(order, results):
+        per_segment[i] = _text_emotion(res)
+
+    totals, weight = {}, 0
+    segment_results = []
+    for seg, (top_label, top_score, predictions) in zip(segments, per_segment):
+        w = len(seg["text"])
+        weight += w
+        for lbl, sc in predictions:
+            totals[lbl] = totals.get(lbl, 0.0) + w * sc
+        segment_results.append({
+            "start": seg["start"],
+            "end": seg["end"],
+            "text": seg["text"],
+            "label": top_label,
+            "score": top_score,
+            "predictions": predictions,
+        })
+    text_predictions = sorted(((lbl, sc / weight) for lbl, sc in totals.items()),
+                              key=lambda x: x[1], reverse=True)
+    top_text_label, top_text_score = text_predictions[0]
+    return top_text_label, top_text_score, text_predictions, segment_results
+
+def print_debug(audio_predictions, text_predictions):
+    print("[DEBUG] Audio predictions:")
+    for lbl, sc in audio_predictions:
+        print(f"  {lbl}: {sc:.2f}")
+    print("[DEBUG] Text predictions:")
+    for lbl, sc in text_predictions[:5]:
+        print(f"  {lbl}: {sc:.2f}")
+
+def detect_emotion(audio, transcript: str, debug: bool = False, window_s: float = None, hop_s: float = None,
+                   segments=None):
+    if window_s:
+        final_audio_label, top_audio_score, audio_predictions, _ = detect_audio_emotion_windowed(
+            audio, window_s, hop_s or window_s / 2)
+    else:
+        final_audio_label, top_audio_score, audio_predictions = detect_audio_emotion(audio)
+    if segments:
+        top_text_label, top_text_score, text_predictions, _ = detect_text_emotion_segments(segments)
+    else:
+        top_text_label, top_text_score, text_predictions = detect_text_emotion(transcript)
 
     if debug:
-        print("[DEBUG] Audio predictions:")
-        for lbl, sc in audio_predictions:
-            print(f"  {lbl}: {sc:.2f}")
-        print("[DEBUG] Text predictions:")
-        for lbl, sc in text_predictions[:5]:
-            print(f"  {lbl}: {sc:.2f}")
+        print_debug(audio_predictions, text_predictions)
 
     return final_audio_label, top_audio_score, audio_predictions, top_text_label, top_text_score, text_predictions
+
+def _by_length(items):
+    # Sorting by length keeps similarly sized inputs in the same padded batch
+    return sorted(range(len(items)), key=lambda i: len(items[i]))
+
+def _windowed_batch(waveforms, window_s, hop_s, batch_size):
+    # Windows from every clip share batches (all full windows have the same
+    # length); each clip is then summarized as detect_audio_emotion_windowed does
+    window, hop = int(window_s * SAMPLE_RATE), int(hop_s * SAMPLE_RATE)
+    items = [(c, start, w) for c, waveform in enumerate(waveforms) for start, w in iter_windows(waveform, window, hop)]
+    classifier = get_audio_classifier()
+    timelines = [[] for _ in waveforms]
+    for batch in _equal_length_batches([w for _, _, w in items], batch_size):
+        results = classifier([as_pipeline_input(items[i][2]) for i in batch],
+                             top_k=len(audio_label_map), batch_size=batch_size)
+        for i, res in zip(batch, results):
+            c, start, w = items[i]
+            timelines[c].append(_timeline_entry(start, len(w), res))
+    return [summarize_timeline(sorted(t, key=lambda e: e["start"])) for t in timelines]
+
+def detect_emotion_batch(audios, transcripts, batch_size: int = 8, debug: bool = False,
+                         window_s: float = None, hop_s: float = None):
+    # Text is always batched. Whole-clip audio is batched only between clips
+    # of exactly the same length (no attention mask, see _equal_length_batches),
+    # which real recordings almost never are, so without window_s the voice
+    # model effectively runs one clip at a time. With window_s the clips are
+    # cut into fixed windows that do batch, and scores match
+    # detect_emotion(..., window_s=window_s).
+    if len(audios) != len(transcripts):
+        raise ValueError("audios and transcripts must have the same length")
+    if not audios:
+        return []
+
+    waveforms = [load_audio(a) for a in audios]
+    if window_s:
+        audio_out = _windowed_batch(waveforms, window_s, hop_s or window_s / 2, batch_size)
+    else:
+        classifier = get_audio_classifier()
+        audio_out = [None] * len(waveforms)
+        for batch in _equal_length_batches(waveforms, batch_size):
+            audio_results = classifier([as_pipeline_input(waveforms[i]) for i in batch],
+                                       top_k=len(audio_label_map), batch_size=batch_size)
+            for i, res in zip(batch, audio_results):
+                audio_out[i] = _audio_emotion(res)
+
+    # The tokenizer pads with an attention mask, so text can share batches
+    text_order = _by_length(transcripts)
+    text_results = get_text_classifier()(
+        [transcripts[i] for i in text_order], batch_size=batch_size, **_TEXT_KWARGS)
+    text_out = [None] * len(transcripts)
+    for i, res in zip(text_order, text_results):
+        text_out[i] = _text_emotion(res)
+
+    results = []
+    for (final_audio_label, top_audio_score, audio_predictions), (top_text_label, top_text_score, text_predictions) in zip(audio_out, text_out):
+        if debug:
+            print_debug(audio_predictions, text_predictions)
+        results.append((final_audio_label, top_audio_score, audio_predictions, top_text_label, top_text_score, text_predictions))
+    return results
+
+def verify_batch(audios, transcripts, batch_size: int = 8, atol: float = 1e-4, window_s: float = None,
+                 hop_s: float = None) -> float:
+    # Largest score difference between detect_emotion_batch and per-item
+    # detect_emotion on the same inputs; raises past atol
+    batched = detect_emotion_batch(audios, transcripts, batch_size, window_s=window_s, hop_s=hop_s)
+    worst = 0.0
+    for audio, transcript, got in zip(audios, transcripts, batched):
+        ref = detect_emotion(audio, transcript, window_s=window_s, hop_s=hop_s)
+        for idx in (2, 5):
+            scores = dict(got[idx])
+            worst = max([worst] + [abs(sc - scores.get(lbl, 0.0)) for lbl, sc in ref[idx]])
+    if worst > atol:
+        raise RuntimeError(f"Batched emotion scores differ from single-item scores by {worst:.2e} (atol {atol:.0e})")
+    return worst
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "ASR_RESULT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "emotion-asr", "results"))
+DEFAULT_MAX_MB = float(os.environ.get("ASR_RESULT_CACHE_MB", "256"))
+
+def hash_audio(audio) -> str:
+    # Content hash of the encoded file (or raw bytes / decoded waveform), so the
+    # lookup can happen before any decoding
+    h = hashlib.sha256()
+    if isinstance(audio, np.ndarray):
+        h.update(memoryview(np.ascontiguousarray(audio)).cast("B"))
+    elif isinstance(audio, (bytes, bytearray, memoryview)):
+        h.update(audio)
+    else:
+        with open(audio, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+class ResultCache:
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_MAX_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 2**20)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(audio_hash: str, **settings) -> str:
+        payload = json.dumps({"audio": audio_hash, **settings}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Touch on hit so eviction drops the least recently used entries
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key: str, result: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def size_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
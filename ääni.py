@@ -0,0 +1,95 @@
+import os
+import subprocess
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+def load_audio(audio, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    # Already decoded: hand the same buffer back (no copy for float32 input)
+    if isinstance(audio, np.ndarray):
+        return np.ascontiguousarray(audio, dtype=np.float32).reshape(-1)
+
+    # Encoded bytes (e.g. an upload) are piped to ffmpeg instead of a file
+    from_memory = isinstance(audio, (bytes, bytearray, memoryview))
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", "pipe:0" if from_memory else str(audio),
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "-",
+    ]
+    if from_memory:
+        cmd.remove("-nostdin")
+    try:
+        out = subprocess.run(cmd, input=audio if from_memory else None, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode(errors='ignore')}") from e
+
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def as_pipeline_input(audio):
+    # HF audio pipelines take a path or a {"raw", "sampling_rate"} dict
+    if isinstance(audio, np.ndarray):
+        return {"raw": audio, "sampling_rate": SAMPLE_RATE}
+    return audio
+
+def stream_audio(path, chunk_samples: int = SAMPLE_RATE * 10, sample_rate: int = SAMPLE_RATE):
+    # Decode incrementally so long recordings never sit in memory as a whole
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", str(path),
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "-",
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            raw = proc.stdout.read(chunk_samples * 2)
+            if not raw:
+                break
+            yield np.frombuffer(raw[: len(raw) // 2 * 2], np.int16).astype(np.float32) / 32768.0
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+def iter_windows(audio, window: int, hop: int):
+    # Yields (start_sample, window). Arrays are sliced as views; paths and
+    # chunk iterators go through a fixed-size buffer, so memory stays at one
+    # window regardless of the recording length. The tail is always covered:
+    # arrays get a last window aligned to the end, streams a shorter one.
+    if not 0 < hop <= window:
+        raise ValueError("hop must be between 1 and the window size")
+    if isinstance(audio, np.ndarray):
+        n = len(audio)
+        if n <= window:
+            yield 0, audio
+            return
+        start = 0
+        for start in range(0, n - window + 1, hop):
+            yield start, audio[start:start + window]
+        if start + window < n:
+            yield n - window, audio[n - window:]
+        return
+
+    chunks = stream_audio(audio) if isinstance(audio, (str, os.PathLike)) else audio
+    buf = np.zeros(window, dtype=np.float32)
+    filled = 0       # valid samples in buf
+    buf_start = 0    # timeline position of buf[0]
+    covered = 0      # end of the last yielded window
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        while len(chunk):
+            take = min(window - filled, len(chunk))
+            buf[filled:filled + take] = chunk[:take]
+            filled += take
+            chunk = chunk[take:]
+            if filled == window:
+                yield buf_start, buf.copy()
+                covered = buf_start + window
+                buf[:window - hop] = buf[hop:]
+                filled = window - hop
+                buf_start += hop
+    end = buf_start + filled
+    if end > covered:
+        # Whatever is left (overlap plus the uncovered tail) forms a shorter last window
+        yield buf_start, buf[:filled].copy()
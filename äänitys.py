@@ -6,6 +6,8 @@ import numpy as np
 import scipy.io.wavfile as wav
 import os
 import re
+import threading
+import time
 import keyboard  
 
 def get_next_filename(folder="data", prefix="Audio", extension=".wav"):
@@ -48,5 +50,87 @@ def record_audio_dynamic(sample_rate=16000):
     return filename
 
 
+class RingBuffer:
+    # Fixed-size float32 buffer for the most recent samples; the audio callback
+    # writes into it, the inference loop reads the tail
+    def __init__(self, capacity):
+        self.buf = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.total = 0  # samples written since start
+        self.lock = threading.Lock()
+
+    def write(self, block):
+        block = block.reshape(-1)
+        n = len(block)
+        block = block[-self.capacity:]
+        with self.lock:
+            start = (self.total + n - len(block)) % self.capacity
+            first = min(len(block), self.capacity - start)
+            self.buf[start:start + first] = block[:first]
+            self.buf[:len(block) - first] = block[first:]
+            self.total += n
+
+    def read(self, since):
+        # Samples from absolute position `since` up to now (clamped to what is still held)
+        with self.lock:
+            since = max(since, self.total - self.capacity)
+            n = self.total - since
+            start = since % self.capacity
+            end = start + n
+            if end <= self.capacity:
+                return since, self.buf[start:end].copy()
+            return since, np.concatenate((self.buf[start:], self.buf[:end - self.capacity]))
+
+
+def stream_live(model_size="base", sample_rate=16000, step_s=2.0, context_s=20.0, emotion_window_s=5.0):
+    # Live transcription: audio blocks go into a ring buffer; every step the
+    # uncommitted tail (at most context_s) is transcribed. Segments that end
+    # well before "now" are committed and printed once; the rest is shown as a
+    # partial. Memory is bounded by the ring, latency by context_s.
+    from kuiskaus import transcribe_audio
+    from tunne import detect_audio_emotion, detect_text_emotion
+
+    ring = RingBuffer(int(sample_rate * (context_s + 2 * step_s)))
+    committed = 0  # absolute sample position up to which text is final
+
+    def _callback(indata, frames, time_info, status):
+        ring.write(indata[:, 0])
+
+    print("🎤 Live mode. Press 's' (or Ctrl+C) to stop.")
+    stream = sd.InputStream(samplerate=sample_rate, channels=1, dtype="float32",
+                            blocksize=1024, callback=_callback)
+    stream.start()
+    try:
+        while not keyboard.is_pressed("s"):
+            time.sleep(step_s)
+            start, audio = ring.read(committed)
+            if len(audio) < sample_rate:
+                continue
+            text, _, _, details = transcribe_audio(audio, model_size=model_size, return_details=True)
+
+            # Keep the last segment open unless the buffer is about to run out
+            segments = details["segments"]
+            horizon = len(audio) / sample_rate - step_s
+            final = [seg for seg in segments[:-1] if seg["end"] <= horizon]
+            if len(audio) / sample_rate >= context_s and segments:
+                final = segments
+            for seg in final:
+                if seg["text"]:
+                    label, score, _ = detect_text_emotion(seg["text"])
+                    print(f"\r[LIVE] {seg['text']}  [text: {label} {score:.2f}]")
+            committed = start + int(final[-1]["end"] * sample_rate) if final else start
+            partial = " ".join(seg["text"] for seg in segments[len(final):])
+
+            tail = audio[-int(emotion_window_s * sample_rate):]
+            audio_label, audio_score, _ = detect_audio_emotion(tail)
+            print(f"\r[PARTIAL] {partial[-80:]:<80} [audio: {audio_label} {audio_score:.2f}]", end="", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.stop()
+        stream.close()
+        print("\nLive mode stopped.")
+
+
 if __name__ == "__main__":
     record_audio_dynamic()